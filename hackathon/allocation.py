@@ -0,0 +1,222 @@
+import argparse
+import json
+import sqlite3
+import time
+import numpy as np
+from blood import compatible, encode
+from geo import distance_matrix, vectors_from_rows
+from matching import build_features, score_features
+from scores import DONOR_COLUMNS, RECIPIENT_COLUMNS
+
+# Global allocation of an organ's unmatched donors to its unmatched
+# recipients. match() ranks donors for one recipient at a time, so the best
+# donor tops everyone's list; here all candidate pairs are scored together
+# and one maximum-weight bipartite matching gives each donor to at most one
+# recipient. Results are written as proposals for coordinators to act on.
+#
+#   python allocation.py --organ kidney --db organ_donation.db
+#   python allocation.py --run 12          # a run the app has started
+#
+# The app runs allocations this way, in a child process (see
+# app.run_allocation), so the scoring and matching never hold up its event
+# loop.
+#
+# Recipients are scored a block at a time against every donor. Pairs of
+# incompatible blood types or further apart than max_distance_km are dropped
+# and each recipient keeps only its best candidates_per_recipient, so the
+# matching runs on a sparse graph.
+
+# SQLite database file name
+DB_FILE = 'organ_donation.db'
+
+MAX_DISTANCE_KM = 1000
+CANDIDATES_PER_RECIPIENT = 50
+
+# Pair weight is score * (1 + URGENCY_WEIGHT * (urgency_level - 1)), so a
+# critical (4) recipient counts 2.5x a low (1) one at the default
+URGENCY_WEIGHT = 0.5
+
+# Donor/recipient pairs per distance/scoring block
+BLOCK_PAIRS = 2000000
+
+# Every recipient also gets a private placeholder donor of this weight, so
+# the matching always exists and a recipient without a real donor is simply
+# left unassigned
+UNASSIGNED_WEIGHT = 1e-9
+
+
+def load_pool(cursor, organ):
+    # Donors and recipients of an organ that are not part of a match yet,
+    # as DONOR_COLUMNS / RECIPIENT_COLUMNS rows followed by the blood type
+    cursor.execute(f"""
+        SELECT {DONOR_COLUMNS}, blood_type FROM donors d
+        WHERE organ = ? AND NOT EXISTS (SELECT 1 FROM matches m WHERE m.donor_id = d.id)
+        ORDER BY id
+    """, (organ,))
+    donors = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT {RECIPIENT_COLUMNS}, blood_type FROM recipients r
+        WHERE needed_organ = ? AND NOT EXISTS (SELECT 1 FROM matches m WHERE m.recipient_id = r.id)
+        ORDER BY id
+    """, (organ,))
+    return donors, cursor.fetchall()
+
+
+def candidate_graph(model, scaler, donors, recipients, max_distance_km=MAX_DISTANCE_KM,
+                    per_recipient=CANDIDATES_PER_RECIPIENT, urgency_weight=URGENCY_WEIGHT):
+    # Sparse edges (recipient index, donor index, distance_km, score, weight)
+    # as parallel arrays, at most per_recipient per recipient
+    empty = (np.empty(0, dtype=np.int64),) * 2 + (np.empty(0),) * 3
+    if not donors or not recipients:
+        return empty
+    donor_vectors = vectors_from_rows(donors, 2, 3, 4)
+    donor_ages = np.array([donor[1] for donor in donors], dtype=np.float64)
+    donor_classes = encode([donor[7] for donor in donors])
+    recipient_classes = encode([recipient[8] for recipient in recipients])
+    recipient_vectors = vectors_from_rows(recipients, 3, 4, 5)
+    recipient_ages = np.array([recipient[1] for recipient in recipients], dtype=np.float64)
+    urgency_levels = np.array([recipient[2] for recipient in recipients], dtype=np.float64)
+
+    edges = []
+    step = max(1, BLOCK_PAIRS // len(donors))
+    for start in range(0, len(recipients), step):
+        distances = distance_matrix(recipient_vectors[start:start + step], donor_vectors)
+        rows, cols = np.nonzero((distances <= max_distance_km)
+                                & compatible(recipient_classes[start:start + step], donor_classes))
+        if len(rows) == 0:
+            continue
+        features = build_features(recipient_ages[start + rows], urgency_levels[start + rows], donor_ages[cols],
+                                  distances[rows, cols])
+        scores = np.zeros(distances.shape)
+        scores[rows, cols] = score_features(model, scaler, features)
+        weights = np.full(distances.shape, -np.inf)
+        weights[rows, cols] = (np.maximum(scores[rows, cols], 0) * (1 + urgency_weight * (urgency_levels[start + rows] - 1))
+                               + UNASSIGNED_WEIGHT)
+
+        # Best per_recipient donors of each recipient in the block
+        if per_recipient < len(donors):
+            best = np.argpartition(weights, len(donors) - per_recipient, axis=1)[:, len(donors) - per_recipient:]
+        else:
+            best = np.broadcast_to(np.arange(len(donors)), weights.shape)
+        rows = np.repeat(np.arange(len(weights)), best.shape[1])
+        cols = best.ravel()
+        keep = np.isfinite(weights[rows, cols])
+        rows, cols = rows[keep], cols[keep]
+        edges.append((start + rows, cols, distances[rows, cols], scores[rows, cols], weights[rows, cols]))
+
+    if not edges:
+        return empty
+    return tuple(np.concatenate(parts) for parts in zip(*edges))
+
+
+def solve(recipient_count, donor_count, rows, cols, weights):
+    # Donor index assigned to each recipient index (-1 for none), maximising
+    # the total weight with each donor used at most once
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+    placeholders = np.arange(recipient_count)
+    graph = csr_matrix((np.r_[weights, np.full(recipient_count, UNASSIGNED_WEIGHT)],
+                        (np.r_[rows, placeholders], np.r_[cols, donor_count + placeholders])),
+                       shape=(recipient_count, donor_count + recipient_count))
+    matched_rows, matched_cols = min_weight_full_bipartite_matching(graph, maximize=True)
+    assignment = np.full(recipient_count, -1, dtype=np.int64)
+    assignment[matched_rows] = np.where(matched_cols < donor_count, matched_cols, -1)
+    return assignment
+
+
+def start_run(connection, organ, max_distance_km=MAX_DISTANCE_KM, per_recipient=CANDIDATES_PER_RECIPIENT,
+              urgency_weight=URGENCY_WEIGHT):
+    # Record a run as 'running' and return its id
+    cursor = connection.cursor()
+    cursor.execute("""
+        INSERT INTO allocation_runs (organ, status, parameters) VALUES (?, 'running', ?)
+    """, (organ, json.dumps({'max_distance_km': max_distance_km, 'candidates_per_recipient': per_recipient,
+                             'urgency_weight': urgency_weight})))
+    connection.commit()
+    return cursor.lastrowid
+
+
+def allocate(connection, run_id, model, scaler, model_version):
+    # Run a started allocation and write its proposals in one transaction.
+    # Returns the run summary; a failure is recorded on the run and re-raised.
+    started = time.perf_counter()
+    cursor = connection.cursor()
+    cursor.execute("SELECT organ, parameters FROM allocation_runs WHERE id = ?", (run_id,))
+    organ, parameters = cursor.fetchone()
+    parameters = json.loads(parameters)
+    try:
+        donors, recipients = load_pool(cursor, organ)
+        rows, cols, distances, scores, weights = candidate_graph(
+            model, scaler, donors, recipients, parameters['max_distance_km'],
+            parameters['candidates_per_recipient'], parameters['urgency_weight'])
+        assignment = solve(len(recipients), len(donors), rows, cols, weights)
+
+        # Edge of each assigned (recipient, donor) pair, found by sorted key
+        keys = rows * len(donors) + cols
+        order = np.argsort(keys)
+        assigned = np.flatnonzero(assignment >= 0)
+        edge = order[np.searchsorted(keys[order], assigned * len(donors) + assignment[assigned])]
+        proposals = [(run_id, recipients[r][0], donors[d][0], distance, score, weight)
+                     for r, d, distance, score, weight in zip(
+                         assigned.tolist(), assignment[assigned].tolist(), distances[edge].tolist(),
+                         scores[edge].tolist(), weights[edge].tolist())]
+
+        summary = {
+            'donors': len(donors),
+            'recipients': len(recipients),
+            'candidate_pairs': len(rows),
+            'assigned': len(proposals),
+            'total_weight': float(weights[edge].sum()),
+            'seconds': time.perf_counter() - started,
+        }
+        cursor.execute("BEGIN")
+        cursor.executemany("""
+            INSERT INTO allocation_proposals (run_id, recipient_id, donor_id, distance_km, score, weight)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, proposals)
+        cursor.execute("""
+            UPDATE allocation_runs
+            SET status = 'done', donors = ?, recipients = ?, candidate_pairs = ?, assigned = ?,
+                total_weight = ?, seconds = ?, model_version = ?
+            WHERE id = ?
+        """, (summary['donors'], summary['recipients'], summary['candidate_pairs'], summary['assigned'],
+              summary['total_weight'], summary['seconds'], model_version, run_id))
+        connection.commit()
+        return summary
+    except Exception:
+        connection.rollback()
+        cursor.execute("UPDATE allocation_runs SET status = 'failed', seconds = ? WHERE id = ?",
+                       (time.perf_counter() - started, run_id))
+        connection.commit()
+        raise
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Propose a global donor/recipient allocation for an organ")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--organ')
+    target.add_argument('--run', type=int, metavar='RUN_ID',
+                        help="carry out a started run, with the parameters stored on it")
+    parser.add_argument('--db', default=DB_FILE, help="database file")
+    parser.add_argument('--max-distance', type=float, default=MAX_DISTANCE_KM, help="km")
+    parser.add_argument('--candidates', type=int, default=CANDIDATES_PER_RECIPIENT,
+                        help="best donors kept per recipient")
+    parser.add_argument('--urgency-weight', type=float, default=URGENCY_WEIGHT)
+    args = parser.parse_args()
+
+    import registry
+    from migrations import migrate
+    migrate(args.db)
+    connection = sqlite3.connect(args.db)
+    connection.execute("PRAGMA busy_timeout=5000")
+    model, scaler, model_version = registry.load()
+    if args.run is None:
+        run_id = start_run(connection, args.organ, args.max_distance, args.candidates, args.urgency_weight)
+    else:
+        run_id = args.run
+    summary = allocate(connection, run_id, model, scaler, model_version)
+    connection.close()
+    print(f"Run {run_id}: {summary['assigned']} of {summary['recipients']} recipients assigned from "
+          f"{summary['donors']} donors ({summary['candidate_pairs']} candidate pairs) "
+          f"in {summary['seconds']:.1f}s")
@@ -1,64 +1,316 @@
-from flask import Flask, render_template, request, redirect, session, url_for, flash,g, jsonify
-from sklearn.preprocessing import LabelEncoder
-from sklearn.ensemble import RandomForestRegressor
-import joblib
-import pandas as pd
+import os
+
+# Real-time mode. threading (the default) suits `python app.py` and a single
+# process. In production use eventlet or gevent under gunicorn with several
+# instances sharing SOCKETIO_MESSAGE_QUEUE (see gunicorn.conf.py). The
+# cooperative modes need the standard library patched before anything else
+# is imported.
+SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE', 'threading')
+if SOCKETIO_ASYNC_MODE == 'eventlet':
+    import eventlet
+    eventlet.monkey_patch()
+elif SOCKETIO_ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+from flask import Flask, render_template, request, redirect, session, url_for, flash,g, jsonify, Response, stream_with_context
 import sqlite3
-import math
+import functools
+import threading
+import argparse
+import signal
+import subprocess
+import sys
+import time
 from flask_socketio import SocketIO, emit,join_room,leave_room
 from flask_cors import CORS
 import json
+import heapq
+from migrations import migrate
+from database import ConnectionPool
+from match_cache import MatchCache
+from background import TaskQueue
+from event_log import EventLog, SharedEventLog
+import outbox
+import metrics
+
+# Where room emits are published so clients on every worker receive them:
+# a redis://, amqp:// or kafka:// URL for the backends Flask-SocketIO ships
+# with, or unix:// (or unix:///path) for the local relay in message_queue.py.
+# Unset, emits only reach this process's clients.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+# Per-packet Socket.IO/Engine.IO logging, for debugging only
+SOCKETIO_LOGGING = bool(os.environ.get('SOCKETIO_LOGGING'))
+
+
+def socketio_queue_options(url):
+    if not url:
+        return {}
+    if url.startswith('unix://'):
+        from message_queue import UnixSocketManager
+        return {'client_manager': UnixSocketManager(url)}
+    return {'message_queue': url}
+
 
 app = Flask(__name__)
 socketio = SocketIO(app, 
     cors_allowed_origins="*",
-    async_mode='threading',
-    logger=True,
-    engineio_logger=True
+    async_mode=SOCKETIO_ASYNC_MODE,
+    logger=SOCKETIO_LOGGING,
+    engineio_logger=SOCKETIO_LOGGING,
+    **socketio_queue_options(SOCKETIO_MESSAGE_QUEUE)
 )
 app.config['SECRET_KEY'] = 'khwaabonauts-lifelink-2024'
 app.config['SESSION_TYPE'] = 'filesystem'
 CORS(app)
 
-# Load pre-trained model, scaler, and label encoder
-model = joblib.load('organ_matching_model.pkl')
-scaler = joblib.load('scaler.pkl')
-label_encoder = joblib.load('label_encoder.pkl')
+# The model artifacts and the NumPy-based geo/scoring modules are loaded on
+# first use, or up front by warmup(), so importing app stays cheap
+_model_lock = threading.Lock()
+_model = None
+
+# A new active version in the model registry is noticed at most this many
+# seconds later by every worker (0 turns the check off)
+MODEL_CHECK_SECONDS = float(os.environ.get('MODEL_CHECK_SECONDS', 10))
+_manifest_seen = None  # manifest mtime when the served model was loaded
+_manifest_checked = 0.0
+_model_reload = {'pending': False, 'reloads': 0, 'loaded_at': None, 'last_error': None}
+
+
+def manifest_mtime():
+    import registry
+    try:
+        return os.stat(registry.manifest_path()).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_model():
+    # (model, scaler, model_version) of the registry's active version (see
+    # registry.py). The model and scaler are served from the flattened
+    # export (see forest.py), so scoring never goes through sklearn or
+    # pandas. model_version is recorded with every compatibility score;
+    # callers take all three from one call so they always agree.
+    global _model, _manifest_seen, _manifest_checked
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import registry
+                _manifest_seen = manifest_mtime()
+                _manifest_checked = time.monotonic()
+                _model = registry.load()
+                _model_reload['loaded_at'] = time.time()
+    elif MODEL_CHECK_SECONDS and time.monotonic() - _manifest_checked > MODEL_CHECK_SECONDS:
+        _manifest_checked = time.monotonic()
+        if manifest_mtime() != _manifest_seen:
+            schedule_model_reload()
+    return _model
+
+
+def reload_model(version=None):
+    # Load and validate a version (default: the active one) off the request
+    # path, then swap it in with a single assignment. Requests already
+    # holding the old tuple finish with it. Given a version, it is also made
+    # active in the manifest, so the other workers follow.
+    global _model, _manifest_seen
+    import registry
+    seen = manifest_mtime()
+    try:
+        loaded = registry.load(version)
+        if version is not None:
+            registry.activate(version)
+            seen = manifest_mtime()
+        with _model_lock:
+            _model = loaded
+        # Lists scored by the previous model would otherwise be served until
+        # their TTL runs out
+        match_cache.clear()
+        _model_reload.update(reloads=_model_reload['reloads'] + 1, loaded_at=time.time(), last_error=None)
+        print(f"Model {loaded[2]} loaded")
+    except Exception as e:
+        # Keep serving the current model; retried when the manifest changes
+        _model_reload['last_error'] = str(e)
+        print(f"Model reload failed: {e}")
+    finally:
+        _manifest_seen = seen
+        _model_reload['pending'] = False
+
+
+def schedule_model_reload(version=None):
+    # Queue reload_model unless one is already waiting
+    with _model_lock:
+        if _model_reload['pending']:
+            return False
+        _model_reload['pending'] = True
+    model_tasks.submit('reload_model', reload_model, version)
+    return True
+
+
+def handle_reload_signal(signum, frame):
+    # Signal handlers must not block on a lock the interrupted code may
+    # hold, so the reload is queued from a thread
+    threading.Thread(target=schedule_model_reload, name='model-reload-signal', daemon=True).start()
+
+# `kill -USR2 <worker pid>` reloads the active model in that worker. Only
+# the main thread may install handlers (not the case under some test
+# runners); gunicorn imports the app in each worker's main thread.
+if hasattr(signal, 'SIGUSR2') and threading.current_thread() is threading.main_thread():
+    signal.signal(signal.SIGUSR2, handle_reload_signal)
+
+
+@functools.lru_cache(maxsize=None)
+def get_label_encoder():
+    # Unpickling the LabelEncoder imports sklearn, so only do it when needed
+    import joblib
+    return joblib.load('label_encoder.pkl')
 
 # SQLite database file name
-DB_FILE = 'organ_donation.db'
+DB_FILE = os.environ.get('DB_FILE', 'organ_donation.db')
 
 DATABASE = DB_FILE  # Replace with the name of your database file
 
+# Bring the schema up to date before serving (no-op when already current)
+migrate(DB_FILE)
+
+
+# Tuned connections reused across requests instead of one connect() per route
+db_pool = ConnectionPool(DATABASE, factory=metrics.TimedConnection if metrics.ENABLED else sqlite3.Connection)
+
+# METRICS=1 serves request, SQL, model and emit metrics at /metrics
+if metrics.ENABLED:
+    metrics.install(app)
+
+# Scored candidate lists per recipient, invalidated when donors or the
+# recipient change (see approve_donor, approve_recipient, delete_user)
+match_cache = MatchCache(maxsize=int(os.environ.get('MATCH_CACHE_SIZE', 512)),
+                         ttl=float(os.environ.get('MATCH_CACHE_TTL', 300)))
+
+# Work that shouldn't block a response
+background_tasks = TaskQueue('background-tasks')
+
+# Model loads for hot reload (see reload_model)
+model_tasks = TaskQueue('model-reload')
+
+# Global allocation runs take minutes, so they get their own queue (one run
+# at a time) rather than holding up background_tasks. The work itself runs
+# in a child process (see run_allocation); this queue only waits for it.
+allocation_tasks = TaskQueue('allocations')
+ALLOCATION_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'allocation.py')
+
+# Recent request events per Socket.IO room, replayed to clients that rejoin.
+# With a message queue other workers emit to the same rooms, so the log (and
+# its sequence numbers) lives in the database instead of this process.
+if SOCKETIO_MESSAGE_QUEUE:
+    event_log = SharedEventLog(db_pool, max_events=int(os.environ.get('EVENT_LOG_SIZE', 100)))
+else:
+    event_log = EventLog(max_events=int(os.environ.get('EVENT_LOG_SIZE', 100)))
+
+
+def donor_room(donor_id):
+    return f"donor:{donor_id}"
+
+
+def recipient_room(recipient_id):
+    return f"recipient:{recipient_id}"
+
+
+def emit_event(event, payload, room):
+    # Send a change to a room, numbered so clients can apply it in place and
+    # notice (or replay) anything they missed
+    socketio.emit(event, event_log.append(room, event, payload), room=room)
+    if metrics.ENABLED:
+        metrics.record_emit(event, room)
+
+
+# Socket events recorded in the outbox table by the transaction that caused
+# them, and sent from background_tasks after it commits. Started right away
+# to send anything a previous worker left behind.
+outbox_dispatcher = outbox.OutboxDispatcher(db_pool, lambda room, event, payload: emit_event(event, payload, room),
+                                            background_tasks)
+outbox_dispatcher.start()
+
 
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row  # Allows dict-like access to rows
+        db = g._database = db_pool.acquire()
     return db
 
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
+
+NOTIFICATION_PAGE_SIZE = 50
+MAX_NOTIFICATION_PAGE_SIZE = 200
+
+
+def read_cursor(cursor, user_id):
+    # (subscribed_from, last_read_id) for a user, (0, 0) if never recorded
+    cursor.execute("SELECT subscribed_from, last_read_id FROM notification_cursors WHERE user_id = ?",
+                   (user_id,))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else (0, 0)
 
 # Function to fetch notifications for a user
-def fetch_notifications_for_user(user_id):
-    connection = sqlite3.connect(DB_FILE)
+def fetch_notifications_for_user(user_id, since_id=0, limit=NOTIFICATION_PAGE_SIZE):
+    # Oldest-first page of the user's notifications with id > since_id: events
+    # addressed to them plus events on their organ topic since they subscribed.
+    # Each source is one index range read capped at limit, merged here, so a
+    # page costs the same however many events exist.
+    connection = get_db()
     cursor = connection.cursor()
-    cursor.execute("SELECT message, type FROM notifications WHERE user_id = ?", (user_id,))
+    subscribed_from, _ = read_cursor(cursor, user_id)
+
+    cursor.execute("""
+        SELECT id, message, type FROM notification_events
+        WHERE user_id = ? AND id > ?
+        ORDER BY id LIMIT ?
+    """, (user_id, since_id, limit))
     notifications = cursor.fetchall()
-    connection.close()
-    return [{'message': msg, 'type': notif_type} for msg, notif_type in notifications]
+
+    cursor.execute("SELECT needed_organ FROM recipients WHERE id = ?", (user_id,))
+    recipient = cursor.fetchone()
+    if recipient:
+        cursor.execute("""
+            SELECT id, message, type FROM notification_events
+            WHERE topic = ? AND id > ?
+            ORDER BY id LIMIT ?
+        """, (notification_topic(recipient[0]), max(since_id, subscribed_from), limit))
+        notifications += cursor.fetchall()
+
+    notifications.sort(key=lambda row: row[0])
+    return [{'id': notif_id, 'message': msg, 'type': notif_type}
+            for notif_id, msg, notif_type in notifications[:limit]]
 
 @app.route('/notifications/<int:user_id>', methods=['GET'])
 def get_notifications(user_id):
-    notifications = fetch_notifications_for_user(user_id)
+    # ?since_id=<id>&limit=<n> pages forward; pass the last id received as the
+    # next since_id. ?unread=1 starts from the user's read cursor instead.
+    limit = min(max(request.args.get('limit', NOTIFICATION_PAGE_SIZE, type=int), 1),
+                MAX_NOTIFICATION_PAGE_SIZE)
+    since_id = request.args.get('since_id', type=int)
+    if since_id is None:
+        since_id = read_cursor(get_db().cursor(), user_id)[1] if request.args.get('unread') else 0
+    notifications = fetch_notifications_for_user(user_id, since_id, limit)
     return jsonify(notifications)
 
+@app.route('/notifications/<int:user_id>/read', methods=['POST'])
+def mark_notifications_read(user_id):
+    # Move the user's read cursor forward to last_id (never backwards)
+    last_id = int(request.json['last_id'])
+    connection = get_db()
+    cursor = connection.cursor()
+    cursor.execute("""
+        INSERT INTO notification_cursors (user_id, last_read_id) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET last_read_id = MAX(last_read_id, excluded.last_read_id)
+    """, (user_id, last_id))
+    connection.commit()
+    return jsonify({"success": True, "last_read_id": read_cursor(cursor, user_id)[1]})
+
 @app.route('/')
 def index():
     return render_template('home.html')
@@ -85,17 +337,14 @@ def login():
             if donor:
                 session['user_id'] = donor[0] 
                 session['user_type'] = 'donor'
-                connection.close()
                 return redirect(f'/card/{donor[0]}')
             else:
                 cursor.execute('SELECT id FROM recipients WHERE email = ?', (email,))
                 recipient = cursor.fetchone()
-                connection.close()
                 if recipient:
                     return redirect(f'/match/{recipient[0]}')
                 return redirect(url_for('form'))
         else:
-            connection.close()
             return "Invalid credentials"
             
     return render_template('login.html')
@@ -107,16 +356,9 @@ def register():
         password = request.form['password']
         user_type = request.form['user_type']
         
-        connection = sqlite3.connect(DB_FILE)
+        connection = get_db()
         cursor = connection.cursor()
         
-        cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                            id INTEGER PRIMARY KEY AUTOINCREMENT,
-                            email TEXT UNIQUE,
-                            password TEXT,
-                            user_type TEXT
-                        )''')
-        
         try:
             cursor.execute('INSERT INTO users (email, password, user_type) VALUES (?, ?, ?)',
                            (email, password, user_type))
@@ -130,8 +372,6 @@ def register():
             return redirect(url_for('form'))
         except sqlite3.IntegrityError:
             return "Email already exists"
-        finally:
-            connection.close()
             
     return render_template('register.html')
 
@@ -149,25 +389,17 @@ def form():
     return render_template('form.html', user_type=user_type)
 
 
-def notify_recipients(organ, donor_name):
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-
-    # Fetch all recipients who need the specified organ
-    cursor.execute("SELECT id FROM recipients WHERE needed_organ = ?", (organ,))
-    recipients = cursor.fetchall()
+def notification_topic(organ):
+    # Recipients are subscribed to the topic of the organ they need
+    return f"organ:{organ}"
 
-    for recipient in recipients:
-        recipient_id = recipient[0]
-        message = f"New donor available: {donor_name} for organ: {organ}"
 
-        # Insert notification into the notifications table
-        cursor.execute("INSERT INTO notifications (user_id, message, type) VALUES (?, ?, ?)",
-                       (recipient_id, message, 'new_donor'))
-
-    connection.commit()
-    cursor.close()
-    connection.close()
+def publish_notification(cursor, message, notification_type, topic=None, user_id=None):
+    # One row per event however many users it reaches. The caller commits.
+    cursor.execute("""
+        INSERT INTO notification_events (topic, user_id, message, type)
+        VALUES (?, ?, ?, ?)
+    """, (topic, user_id, message, notification_type))
 
 @app.route('/submit', methods=['POST'])
 def submit():
@@ -183,7 +415,7 @@ def submit():
     longitude = float(request.form.get(f'longitude_{form_type}'))
     latitude = float(request.form.get(f'latitude_{form_type}'))
 
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_db()
     cursor = connection.cursor()
 
     if form_type == 'donor':
@@ -192,12 +424,13 @@ def submit():
                    VALUES (?, ?, ?, ?, ?, ?, ?)"""
         data = (full_name, email, blood_type, organ, age, longitude, latitude)
         cursor.execute(query, data)        
+
+        # Notify recipients about the new donor: one event for the organ's
+        # topic, resolved per recipient when they read their notifications
+        publish_notification(cursor, f"New donor available: {full_name} for organ: {organ}",
+                             'new_donor', topic=notification_topic(organ))
         connection.commit()
         cursor.close()
-        connection.close()
-
-        # Notify recipients about the new donor
-        notify_recipients(organ, full_name)  # Implement this function to notify recipients
 
         return render_template('confirmation_card.html', user_type='donor', full_name=full_name, 
                                email=email, blood_type=blood_type, organ=organ, age=age,
@@ -213,18 +446,17 @@ def submit():
         recipient_id = cursor.lastrowid
         connection.commit()
         cursor.close()
-        connection.close()
 
         return redirect(f'/match/{recipient_id}')
 
 @app.route('/map-matches/<int:recipient_id>')
 def map_matches(recipient_id):
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_db()
     cursor = connection.cursor()
 
     
     recipient_query = """
-        SELECT full_name, latitude, longitude, needed_organ
+        SELECT full_name, latitude, longitude, needed_organ, geo_x, geo_y, geo_z, blood_type
         FROM recipients
         WHERE id = ?
     """
@@ -241,20 +473,46 @@ def map_matches(recipient_id):
         'needed_organ': recipient[3]
     }
 
-    # Fetch donors matching the needed organ
+    from blood import donor_types
+    from geo import bounding_box, distances_km, rtree_clause, vectors_from_rows
+
+    # Optional ?max_distance=<km> radius or ?south=&north=&west=&east= viewport,
+    # answered from the donors R*Tree instead of scanning every donor
+    max_distance = request.args.get('max_distance', type=float)
+    viewport = [request.args.get(edge, type=float) for edge in ('south', 'north', 'west', 'east')]
+    box = None
+    if None not in viewport:
+        box = tuple(viewport)
+    elif max_distance is not None:
+        box = bounding_box(recipient_data['latitude'], recipient_data['longitude'], max_distance)
+
+    # Fetch donors of the needed organ and a blood type the recipient can receive
     donor_query = """
-        SELECT id,full_name, latitude, longitude, organ
+        SELECT id,full_name, latitude, longitude, organ, geo_x, geo_y, geo_z
         FROM donors
-        WHERE organ = ?
+        WHERE organ = ? AND blood_type IN (SELECT value FROM json_each(?))
     """
-    cursor.execute(donor_query, (recipient_data['needed_organ'],))
+    donor_params = (recipient_data['needed_organ'], json.dumps(donor_types(recipient[7])))
+    if box is not None:
+        clause, box_params = rtree_clause(box)
+        donor_query = f"""
+            SELECT d.id, d.full_name, d.latitude, d.longitude, d.organ, d.geo_x, d.geo_y, d.geo_z
+            FROM donors_rtree r JOIN donors d ON d.id = r.id
+            WHERE d.organ = ? AND d.blood_type IN (SELECT value FROM json_each(?)) AND {clause}
+        """
+        donor_params += box_params
+    cursor.execute(donor_query, donor_params)
     donors = cursor.fetchall()
     cursor.close()
-    connection.close()
 
-    if not donors:
+    if not donors and box is None:
         return "No matching donors found", 404
 
+    if max_distance is not None and donors:
+        recipient_vector = vectors_from_rows([recipient], 1, 2, 4)[0]
+        distances = distances_km(recipient_vector, vectors_from_rows(donors, 2, 3, 5))
+        donors = [donor for donor, distance in zip(donors, distances) if distance <= max_distance]
+
     # Prepare data for map rendering
     matches = [
         {
@@ -277,49 +535,52 @@ def handle_request():
     action = data['action']
     status = 'accepted' if action == 'accept' else 'declined'
 
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_db()
     cursor = connection.cursor()
     
     try:
-        if status == 'accepted':
-            # Get request details
+        # Get request details
+        cursor.execute('''
+            SELECT r.recipient_id, r.donor_id, d.full_name, rec.full_name, d.organ
+            FROM requests r
+            JOIN donors d ON r.donor_id = d.id
+            JOIN recipients rec ON r.recipient_id = rec.id
+            WHERE r.id = ?
+        ''', (request_id,))
+        result = cursor.fetchone()
+
+        if status == 'accepted' and result:
+            recipient_id, donor_id, donor_name, recipient_name, organ = result
+
+            # Store in matches
             cursor.execute('''
-                SELECT r.recipient_id, r.donor_id, d.full_name, rec.full_name, d.organ,
-                       d.email as donor_email, rec.email as recipient_email
-                FROM requests r
-                JOIN donors d ON r.donor_id = d.id
-                JOIN recipients rec ON r.recipient_id = rec.id
-                WHERE r.id = ?
-            ''', (request_id,))
-            
-            result = cursor.fetchone()
-            if result:
-                recipient_id, donor_id, donor_name, recipient_name, organ, donor_email, recipient_email = result
-                
-                # Store in matches
-                cursor.execute('''
-                    INSERT INTO matches (donor_id, recipient_id, donor_name, recipient_name, organ)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (donor_id, recipient_id, donor_name, recipient_name, organ))
-                
-                # Emit socket events
-                socketio.emit('request_update', {
-                    'status': 'accepted',
-                    'donor_name': donor_name,
-                    'recipient_name': recipient_name,
-                    'organ': organ
-                }, room=donor_email)
-                
-                socketio.emit('request_update', {
-                    'status': 'accepted',
-                    'donor_name': donor_name,
-                    'recipient_name': recipient_name,
-                    'organ': organ
-                }, room=recipient_email)
+                INSERT INTO matches (donor_id, recipient_id, donor_name, recipient_name, organ)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (donor_id, recipient_id, donor_name, recipient_name, organ))
         
         # Update request status
         cursor.execute("UPDATE requests SET status = ? WHERE id = ?", (status, request_id))
+
+        # Socket events go in the outbox in this transaction and are sent
+        # after commit. The payload is the whole updated row, so clients
+        # update in place without refetching.
+        if result:
+            recipient_id, donor_id, donor_name, recipient_name, organ = result
+            update = {
+                'id': request_id,
+                'donor_id': donor_id,
+                'recipient_id': recipient_id,
+                'status': status,
+                'donor_name': donor_name,
+                'recipient_name': recipient_name,
+                'organ': organ
+            }
+            key = f"request:{request_id}"
+            outbox.enqueue(cursor, donor_room(donor_id), 'request_update', update, key)
+            outbox.enqueue(cursor, recipient_room(recipient_id), 'request_update', update, key)
+
         connection.commit()
+        outbox_dispatcher.wake()
         
         return jsonify({"success": True})
 
@@ -327,8 +588,6 @@ def handle_request():
         print(f"Database error: {e}")
         return jsonify({"success": False, "error": str(e)})
         
-    finally:
-        connection.close()
 
 @app.route('/send_request', methods=['POST'])
 def send_request():
@@ -350,8 +609,9 @@ def send_request():
                 cursor.execute("ROLLBACK")
                 return jsonify({"success": False, "message": "Donor not found"})
                 
-            cursor.execute("SELECT id FROM recipients WHERE id = ?", (recipient_id,))
-            if not cursor.fetchone():
+            cursor.execute("SELECT full_name FROM recipients WHERE id = ?", (recipient_id,))
+            recipient = cursor.fetchone()
+            if not recipient:
                 cursor.execute("ROLLBACK")
                 return jsonify({"success": False, "message": "Recipient not found"})
             
@@ -374,15 +634,21 @@ def send_request():
                 (donor_id, recipient_id)
             )
             
-            cursor.execute("COMMIT")
+            request_id = cursor.lastrowid
             
-            # Emit socket event to donor's room
-            socketio.emit('new_request', {
+            # Socket event to donor's room, carrying the new request row,
+            # sent once the transaction commits
+            outbox.enqueue(cursor, donor_room(donor_id), 'new_request', {
                 'type': 'new_request',
+                'id': request_id,
                 'donor_id': donor_id,
                 'recipient_id': recipient_id,
+                'recipient_name': recipient[0],
                 'status': 'pending'
-            }, room=str(donor_id))
+            }, f"request:{request_id}")
+            
+            cursor.execute("COMMIT")
+            outbox_dispatcher.wake()
             
             return jsonify({
                 "success": True, 
@@ -428,7 +694,7 @@ def get_accepted_requests(recipient_id):
         cursor = db.cursor()
         
         cursor.execute("""
-            SELECT d.full_name AS donor_name, d.organ 
+            SELECT d.full_name AS donor_name, d.organ, r.id 
             FROM requests r
             JOIN donors d ON r.donor_id = d.id 
             WHERE r.recipient_id = ? AND r.status = 'accepted'
@@ -437,19 +703,80 @@ def get_accepted_requests(recipient_id):
         requests = cursor.fetchall()
         return jsonify([{
             'donor_name': row[0],
-            'organ': row[1]
+            'organ': row[1],
+            'id': row[2]
         } for row in requests])
     except Exception as e:
         print(f"Error getting accepted requests: {str(e)}")
         return jsonify([])
 
+def rescore_recipient(connection, recipient_id):
+    # Replace a recipient's stored scores with ones from the current model
+    from scores import mark_scored, score_recipient, save_scores
+
+    model, scaler, model_version = get_model()
+    cursor = connection.cursor()
+    fresh_scores = score_recipient(cursor, model, scaler, recipient_id)
+    cursor.execute("DELETE FROM compatibility_scores WHERE recipient_id = ?", (recipient_id,))
+    save_scores(cursor, fresh_scores, model_version)
+    mark_scored(cursor, [recipient_id], model_version)
+    connection.commit()
+    cursor.close()
+
+def scores_current(cursor, recipient_id, model_version):
+    # True when the recipient was scored by model_version (per its
+    # scored_recipients marker, so having no candidates still counts) and no
+    # stored row comes from another version
+    cursor.execute("""
+        SELECT EXISTS (SELECT 1 FROM scored_recipients WHERE recipient_id = ? AND model_version = ?),
+               EXISTS (SELECT 1 FROM compatibility_scores WHERE recipient_id = ? AND model_version IS NOT ?)
+    """, (recipient_id, model_version, recipient_id, model_version))
+    marked, stale = cursor.fetchone()
+    return bool(marked) and not stale
+
+def stored_candidates(connection, recipient_id, recipient_data, max_distance=float('inf')):
+    # Match rows for a recipient read from compatibility_scores, best first.
+    # Scores that are missing or were computed by another model version are
+    # recomputed and saved before reading.
+    import numpy as np
+
+    model, scaler, model_version = get_model()
+    cursor = connection.cursor()
+    candidate_query = """
+        SELECT cs.donor_id, d.full_name, d.organ, cs.distance_km, cs.score, cs.model_version
+        FROM compatibility_scores cs
+        JOIN donors d ON d.id = cs.donor_id
+        WHERE cs.recipient_id = ? AND cs.distance_km <= ?
+        ORDER BY cs.score DESC, cs.donor_id
+    """
+    # Pad by the rounding applied to 'distance' below
+    candidate_params = (recipient_id, max_distance + 0.01)
+    cursor.execute(candidate_query, candidate_params)
+    rows = cursor.fetchall()
+
+    if any(row[5] != model_version for row in rows) or not scores_current(cursor, recipient_id, model_version):
+        rescore_recipient(connection, recipient_id)
+        cursor.execute(candidate_query, candidate_params)
+        rows = cursor.fetchall()
+    cursor.close()
+
+    return [{
+        'donor_id': row[0],
+        'donor_name': row[1],
+        'organ': row[2],
+        'distance': np.round(row[3], 2),
+        'urgency_score': recipient_data['urgency_score'],
+        'compatibility_score': np.round(row[4], 2)
+    } for row in rows]
+
 @app.route('/match/<int:recipient_id>', methods=['GET', 'POST'])
 def match(recipient_id):
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_db()
     cursor = connection.cursor()
 
     # Get recipient information
-    recipient_query = """SELECT full_name, blood_type, needed_organ, urgency_level, age, latitude, longitude
+    recipient_query = """SELECT full_name, blood_type, needed_organ, urgency_level, age, latitude, longitude,
+                                geo_x, geo_y, geo_z
                          FROM recipients WHERE id = ?"""
     cursor.execute(recipient_query, (recipient_id,))
     recipient = cursor.fetchone()
@@ -467,72 +794,41 @@ def match(recipient_id):
         'longitude': float(recipient[6])
     }
 
-    # Get matching donors
-    donor_query = """SELECT id, full_name, blood_type, organ, age, latitude, longitude
-                     FROM donors WHERE organ = ?"""
-    cursor.execute(donor_query, (recipient_data['needed_organ'],))
-    donors = cursor.fetchall()
+    max_distance = float('inf')
+    if request.method == 'POST':
+        max_distance_str = request.form.get('max_distance', '')
+        max_distance = float(max_distance_str) if max_distance_str else float('inf')
+
+    # Sort/filter POSTs reuse the list scored by an earlier request
+    candidates = match_cache.get(recipient_id, max_distance)
+    if candidates is None:
+        candidates = stored_candidates(connection, recipient_id, recipient_data, max_distance)
+        match_cache.put(recipient_id, recipient_data['needed_organ'], candidates, max_distance)
 
-    if not donors:
+    if not candidates and max_distance == float('inf'):
         return "No matching donors found", 404
 
-    results = []
-    for donor in donors:
-        donor_data = {
-            'donor_id': donor[0],
-            'full_name': donor[1],
-            'blood_type': donor[2],
-            'organ': donor[3],
-            'age': donor[4],
-            'latitude': float(donor[5]),
-            'longitude': float(donor[6])
-        }
+    # Latest request status for every donor this recipient has contacted, in
+    # one query. SQLite returns the bare status column from the MAX(id) row.
+    request_status_query = """
+        SELECT donor_id, status, MAX(id)
+        FROM requests
+        WHERE recipient_id = ?
+        GROUP BY donor_id
+    """
+    cursor.execute(request_status_query, (recipient_id,))
+    request_statuses = {donor_id: status for donor_id, status, _ in cursor.fetchall()}
 
-        # Calculate compatibility scores
-        donor_blood_type_encoded = label_encoder.transform([donor_data['blood_type']])[0]
-        receiver_blood_type_encoded = label_encoder.transform([recipient_data['blood_type']])[0]
-        location_distance = haversine(recipient_data['latitude'], recipient_data['longitude'],
-                                      donor_data['latitude'], donor_data['longitude'])
-        age_similarity = 1 / (1 + abs(donor_data['age'] - recipient_data['age']))
-
-        input_data = pd.DataFrame([{
-            'age_similarity': age_similarity,
-            'distance_score': 1 / (1 + location_distance),
-            'urgency_level': recipient_data['urgency_score']
-        }])
-
-        input_data_scaled = scaler.transform(input_data)
-        compatibility_score = model.predict(input_data_scaled)[0]
-
-        # Get the latest request status for this donor-recipient pair
-        request_status_query = """
-            SELECT status 
-            FROM requests 
-            WHERE donor_id = ? AND recipient_id = ? 
-            ORDER BY id DESC LIMIT 1
-        """
-        cursor.execute(request_status_query, (donor_data['donor_id'], recipient_id))
-        request_status_result = cursor.fetchone()
-        request_status = request_status_result[0] if request_status_result else None
-
-        results.append({
-            'donor_id': donor_data['donor_id'],
-            'donor_name': donor_data['full_name'],
-            'organ': donor_data['organ'],
-            'distance': round(location_distance, 2),
-            'urgency_score': recipient_data['urgency_score'],
-            'compatibility_score': round(compatibility_score, 2),
-            'request_status': request_status  # Add request status to results
-        })
+    # Fresh dicts per request so the cached list is never modified
+    results = [dict(candidate, request_status=request_statuses.get(candidate['donor_id']))
+               for candidate in candidates]
 
     if request.method == 'POST':
         # Handle filtering and sorting
         sort_by = request.form.get('sort_by', 'compatibility_score')
         min_score_str = request.form.get('min_score', '')
-        max_distance_str = request.form.get('max_distance', '')
 
         min_score = float(min_score_str) if min_score_str else 0
-        max_distance = float(max_distance_str) if max_distance_str else float('inf')
 
         # Apply filters
         results = [result for result in results 
@@ -543,13 +839,124 @@ def match(recipient_id):
         results.sort(key=lambda x: x[sort_by], reverse=(sort_by != 'distance'))
 
     cursor.close()
-    connection.close()
 
     return render_template('match.html', 
                          recipient_id=recipient_id, 
                          recipient_name=recipient_data['full_name'], 
                          results=results)
 
+MATCH_API_K = 20
+MAX_MATCH_API_K = 200
+
+@app.route('/api/match/<int:recipient_id>', methods=['GET'])
+def api_match(recipient_id):
+    # Top k matches as JSON: ?k=&min_score=&max_distance=&sort_by=score|distance.
+    # The organ, distance and score filters are part of the candidate query.
+    # By score, the ranked index hands back the first k rows; by distance,
+    # rows stream through a k-sized heap instead of being sorted.
+    k = request.args.get('k', MATCH_API_K, type=int)
+    min_score = request.args.get('min_score', float('-inf'), type=float)
+    max_distance = request.args.get('max_distance', float('inf'), type=float)
+    sort_by = request.args.get('sort_by', 'score')
+    if not 1 <= k <= MAX_MATCH_API_K or sort_by not in ('score', 'distance'):
+        return jsonify({"success": False,
+                        "message": f"Expected 1 <= k <= {MAX_MATCH_API_K} and sort_by=score|distance"}), 400
+
+    connection = get_db()
+    cursor = connection.cursor()
+    cursor.execute("SELECT needed_organ FROM recipients WHERE id = ?", (recipient_id,))
+    recipient = cursor.fetchone()
+    if recipient is None:
+        return jsonify({"success": False, "message": "Recipient not found"}), 404
+
+    # Same freshness rule as stored_candidates, without reading every row
+    _, _, model_version = get_model()
+    if not scores_current(cursor, recipient_id, model_version):
+        rescore_recipient(connection, recipient_id)
+
+    candidate_query = """
+        SELECT cs.donor_id, d.full_name, cs.distance_km, cs.score
+        FROM compatibility_scores cs
+        JOIN donors d ON d.id = cs.donor_id
+        WHERE cs.recipient_id = ? AND d.organ = ? AND cs.distance_km <= ? AND cs.score >= ?
+    """
+    params = (recipient_id, recipient[0], max_distance, min_score)
+    if sort_by == 'score':
+        cursor.execute(candidate_query + " ORDER BY cs.score DESC, cs.donor_id LIMIT ?", params + (k,))
+        rows = cursor.fetchall()
+    else:
+        cursor.execute(candidate_query, params)
+        rows = heapq.nsmallest(k, cursor, key=lambda row: (row[2], row[0]))
+
+    cursor.execute("""
+        SELECT donor_id, status, MAX(id)
+        FROM requests
+        WHERE recipient_id = ? AND donor_id IN (SELECT value FROM json_each(?))
+        GROUP BY donor_id
+    """, (recipient_id, json.dumps([row[0] for row in rows])))
+    request_statuses = {donor_id: status for donor_id, status, _ in cursor.fetchall()}
+    cursor.close()
+
+    return jsonify({
+        'recipient_id': recipient_id,
+        'matches': [{
+            'donor_id': row[0],
+            'name': row[1],
+            'distance_km': round(row[2], 2),
+            'score': round(row[3], 4),
+            'request_status': request_statuses.get(row[0]),
+        } for row in rows],
+    })
+
+@app.route('/match-cache/stats', methods=['GET'])
+def match_cache_stats():
+    return jsonify(match_cache.stats())
+
+@app.route('/event-log/stats', methods=['GET'])
+def event_log_stats():
+    return jsonify(event_log.stats())
+
+@app.route('/outbox/stats', methods=['GET'])
+def outbox_stats():
+    return jsonify(outbox_dispatcher.stats())
+
+@app.route('/background/stats', methods=['GET'])
+def background_stats():
+    # Queue depth and per-task durations; what runs here now is outbox drains
+    # (drain_outbox), which send committed events to Socket.IO rooms
+    return jsonify(background_tasks.stats())
+
+@app.route('/admin/model', methods=['GET'])
+def model_status():
+    # The version being served, the registry manifest and reload state
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    import registry
+    return jsonify({
+        'serving': get_model()[2],
+        'manifest': registry.read_manifest(),
+        'reload': dict(_model_reload),
+    })
+
+@app.route('/admin/model/reload', methods=['POST'])
+def model_reload():
+    # Hot-swap the model: {"version": "..."} activates a registered version,
+    # an empty body reloads the manifest's active one. Loading and
+    # validation happen in the background; poll /admin/model for the result.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    import registry
+    version = (request.get_json(silent=True) or {}).get('version')
+    if version is not None and not any(entry['version'] == version
+                                       for entry in registry.read_manifest()['versions']):
+        return jsonify({"success": False, "message": "Unknown model version"}), 404
+    scheduled = schedule_model_reload(version)
+    return jsonify({"success": True, "scheduled": scheduled}), 202
+
+@app.route('/allocations/stats', methods=['GET'])
+def allocation_stats():
+    return jsonify(allocation_tasks.stats())
+
 @app.route('/card/<int:donor_id>')
 def donor_card(donor_id):
     if 'user_id' not in session or session['user_type'] != 'donor':
@@ -559,7 +966,6 @@ def donor_card(donor_id):
     cursor = connection.cursor()
     cursor.execute('SELECT full_name, email, blood_type, organ, age FROM donors WHERE id = ?', (donor_id,))
     donor = cursor.fetchone()
-    connection.close()
     
     if not donor:
         return "Donor not found", 404
@@ -572,18 +978,6 @@ def donor_card(donor_id):
                          organ=donor[3],
                          age=donor[4])
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radius of Earth in kilometers
-    phi1 = math.radians(lat1)
-    phi2 = math.radians(lat2)
-    delta_phi = math.radians(lat2 - lat1)
-    delta_lambda = math.radians(lon1 - lon2)
-
-    a = math.sin(delta_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    distance = R * c  # in kilometers
-    return distance
-
 @app.route('/admin-login', methods=['GET', 'POST'])
 def admin_login():
     if request.method == 'POST':
@@ -602,34 +996,353 @@ def admin_login():
 def admin_panel():
     if not session.get('admin_logged_in'):
         return redirect(url_for('admin_login'))
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-    
-    # Fetch pre-donors
-    cursor.execute("SELECT * FROM pre_donors")
-    pre_donors = cursor.fetchall()
-    
-    # Fetch pre-recipients
-    cursor.execute("SELECT * FROM pre_recipients") 
-    pre_recipients = cursor.fetchall()
-    
-    cursor.execute("SELECT * FROM users")
-    users = cursor.fetchall()
+    # The tables are filled in page by page from admin_rows
+    return render_template('admin.html', blood_types=sorted(get_label_encoder().classes_))
+
+ADMIN_PAGE_SIZE = 50
+MAX_ADMIN_PAGE_SIZE = 200
+
+# What /admin/api/<table> serves: columns, equality filters (each indexed
+# with id, see migrations.add_admin_indexes), the column ?q= matches as a
+# prefix, and the page order. Pending registrations and users list oldest
+# first; matches newest first, as ids follow match_date.
+ADMIN_TABLES = {
+    'pre_donors': {
+        'columns': ('id', 'full_name', 'email', 'blood_type', 'organ', 'age', 'longitude', 'latitude'),
+        'filters': ('blood_type', 'organ'),
+        'search': 'email',
+        'order': 'ASC',
+    },
+    'pre_recipients': {
+        'columns': ('id', 'full_name', 'email', 'blood_type', 'needed_organ', 'urgency_level', 'age',
+                    'longitude', 'latitude'),
+        'filters': ('blood_type', 'needed_organ', 'urgency_level'),
+        'search': 'email',
+        'order': 'ASC',
+    },
+    'users': {
+        'columns': ('id', 'email', 'user_type'),
+        'filters': ('user_type',),
+        'search': 'email',
+        'order': 'ASC',
+    },
+    'matches': {
+        'columns': ('id', 'donor_name', 'recipient_name', 'organ', 'match_date'),
+        'filters': ('organ',),
+        'search': None,
+        'order': 'DESC',
+    },
+}
+
+def admin_conditions(spec, values):
+    # WHERE conditions and parameters for the filters and q prefix of an
+    # ADMIN_TABLES entry found in values (request.args or a JSON object)
+    conditions, params = [], []
+    for column in spec['filters']:
+        value = values.get(column)
+        if value:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    prefix = values.get('q')
+    if prefix and spec['search']:
+        conditions.append(f"{spec['search']} >= ? AND {spec['search']} < ?")
+        params += [str(prefix), str(prefix) + '\U0010ffff']
+    return conditions, params
+
+@app.route('/admin/api/<table>', methods=['GET'])
+def admin_rows(table):
+    # One keyset page: ?after=<last id of the previous page>&limit=<n> plus
+    # any filters. The first page (no after) also carries the filtered count.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    spec = ADMIN_TABLES.get(table)
+    if spec is None:
+        return jsonify({"success": False, "message": "Unknown table"}), 404
+
+    conditions, params = admin_conditions(spec, request.args)
+    cursor = get_db().cursor()
+    count = None
+    after = request.args.get('after', type=int)
+    if after is None:
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"SELECT COUNT(*) FROM {table} {where}", params)
+        count = cursor.fetchone()[0]
+    else:
+        conditions.append("id > ?" if spec['order'] == 'ASC' else "id < ?")
+        params.append(after)
+
+    limit = min(max(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), 1), MAX_ADMIN_PAGE_SIZE)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT {', '.join(spec['columns'])} FROM {table} {where} "
+                   f"ORDER BY id {spec['order']} LIMIT ?", params + [limit + 1])
+    rows = cursor.fetchall()
+    next_after = rows[limit - 1][0] if len(rows) > limit else None
+    return jsonify({
+        'rows': [dict(zip(spec['columns'], row)) for row in rows[:limit]],
+        'next_after': next_after,
+        'count': count,
+    })
+
+# Rejected records echoed back by /admin/import (all are counted)
+MAX_REPORTED_REJECTS = 100
+
+@app.route('/admin/import', methods=['POST'])
+def admin_import():
+    # Bulk registration upload: multipart 'file' (CSV or JSONL) and 'kind'
+    # (donor or recipient). Rows land in pre_donors/pre_recipients for
+    # approval. The response streams one JSON line per committed batch, then
+    # a summary with up to MAX_REPORTED_REJECTS rejected records.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    import bulk_import
+
+    upload = request.files.get('file')
+    kind = request.form.get('kind')
+    if upload is None or kind not in bulk_import.COLUMNS:
+        return jsonify({"success": False, "message": "Expected a file and kind=donor|recipient"}), 400
+    file_format = request.form.get('format') or bulk_import.detect_format(upload.filename or '')
+    blood_types = set(get_label_encoder().classes_)
+    batch_size = request.form.get('batch_size', bulk_import.BATCH_SIZE, type=int)
+
+    def stream():
+        rejects = []
+
+        def reject(line_number, reason, record):
+            if len(rejects) < MAX_REPORTED_REJECTS:
+                rejects.append({'line': line_number, 'reason': reason, 'record': record})
+
+        records = bulk_import.read_records(bulk_import.text_stream(upload.stream), file_format)
+        with db_pool.connection() as connection:
+            for summary in bulk_import.import_batches(connection, records, kind, blood_types, batch_size, reject):
+                yield json.dumps({'progress': summary}) + '\n'
+        yield json.dumps({'success': True, 'summary': summary, 'rejects': rejects}) + '\n'
+
+    return Response(stream_with_context(stream()), mimetype='application/x-ndjson')
+
+def run_allocation(run_id):
+    # Scoring and matching hold the GIL for the whole run, which on a gevent
+    # or eventlet worker would freeze every socket and trip gunicorn's
+    # timeout. allocation.py does the run in its own process instead, and
+    # waiting on it (patched subprocess) yields to the event loop.
+    result = subprocess.run([sys.executable, ALLOCATION_SCRIPT, '--run', str(run_id), '--db', DB_FILE])
+    if result.returncode != 0:
+        # A run that died before allocate() could record it would otherwise
+        # stay 'running'
+        with db_pool.connection() as connection:
+            connection.execute("UPDATE allocation_runs SET status = 'failed' WHERE id = ? AND status = 'running'",
+                               (run_id,))
+            connection.commit()
+        raise RuntimeError(f"Allocation run {run_id} exited with status {result.returncode}")
+
+@app.route('/admin/allocate/<organ>', methods=['POST'])
+def start_allocation(organ):
+    # Queue a global allocation of the organ's unmatched donors. Optional JSON
+    # body: max_distance_km, candidates_per_recipient, urgency_weight (see
+    # allocation.py). Responds 202 with the run id to poll.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    import allocation
+    body = request.get_json(silent=True) or {}
+    try:
+        max_distance_km = float(body.get('max_distance_km', allocation.MAX_DISTANCE_KM))
+        per_recipient = int(body.get('candidates_per_recipient', allocation.CANDIDATES_PER_RECIPIENT))
+        urgency_weight = float(body.get('urgency_weight', allocation.URGENCY_WEIGHT))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "Invalid allocation parameters"}), 400
+    if max_distance_km <= 0 or per_recipient < 1 or urgency_weight < 0:
+        return jsonify({"success": False, "message": "Invalid allocation parameters"}), 400
+
+    run_id = allocation.start_run(get_db(), organ, max_distance_km, per_recipient, urgency_weight)
+    allocation_tasks.submit('allocate', run_allocation, run_id)
+    return jsonify({"success": True, "run_id": run_id}), 202
+
+@app.route('/admin/allocations/<int:run_id>', methods=['GET'])
+def allocation_proposals(run_id):
+    # A run's status and summary, plus one keyset page of its proposals in
+    # recipient id order (?after=<recipient id>&limit=<n>)
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    cursor = get_db().cursor()
     cursor.execute("""
-            SELECT id, donor_name, recipient_name, organ, match_date 
-            FROM matches 
-            ORDER BY match_date DESC
-        """)
-    matches = cursor.fetchall()
-    connection.close()
-    
-    return render_template('admin.html', 
-                         pre_donors=pre_donors,
-                         pre_recipients=pre_recipients,users=users,matches=matches)
+        SELECT id, organ, status, parameters, donors, recipients, candidate_pairs, assigned, total_weight,
+               seconds, model_version, created_at
+        FROM allocation_runs WHERE id = ?
+    """, (run_id,))
+    run = cursor.fetchone()
+    if run is None:
+        return jsonify({"success": False, "message": "Unknown allocation run"}), 404
+    run = dict(zip(('id', 'organ', 'status', 'parameters', 'donors', 'recipients', 'candidate_pairs',
+                    'assigned', 'total_weight', 'seconds', 'model_version', 'created_at'), run))
+    run['parameters'] = json.loads(run['parameters'])
+
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', ADMIN_PAGE_SIZE, type=int), 1), MAX_ADMIN_PAGE_SIZE)
+    cursor.execute("""
+        SELECT p.recipient_id, r.full_name, r.urgency_level, p.donor_id, d.full_name,
+               p.distance_km, p.score, p.weight
+        FROM allocation_proposals p
+        JOIN recipients r ON r.id = p.recipient_id
+        JOIN donors d ON d.id = p.donor_id
+        WHERE p.run_id = ? AND p.recipient_id > ?
+        ORDER BY p.recipient_id LIMIT ?
+    """, (run_id, after, limit + 1))
+    rows = cursor.fetchall()
+    columns = ('recipient_id', 'recipient_name', 'urgency_level', 'donor_id', 'donor_name',
+               'distance_km', 'score', 'weight')
+    return jsonify({
+        'run': run,
+        'proposals': [dict(zip(columns, row)) for row in rows[:limit]],
+        'next_after': rows[limit - 1][0] if len(rows) > limit else None,
+    })
+
+# Pending registrations approved or rejected per bulk call; the response
+# says how many matching rows remain
+MAX_BULK_ROWS = 5000
+
+# Where approved rows go, and the columns copied across
+PENDING_TABLES = {
+    'pre_donors': ('donors', ('full_name', 'email', 'blood_type', 'organ', 'age', 'longitude', 'latitude')),
+    'pre_recipients': ('recipients', ('full_name', 'email', 'blood_type', 'needed_organ', 'urgency_level',
+                                      'age', 'longitude', 'latitude')),
+}
+
+def select_pending(cursor, table, body):
+    # (ids, remaining) for a bulk call: the rows listed in {"ids": [...]}, or
+    # those matching the same filters /admin/api/<table> takes (as JSON keys).
+    # Without either, {"all": true} is needed to pick every pending row.
+    # None if the body selects nothing.
+    if body.get('ids') is not None:
+        ids = body['ids']
+        if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+            return None
+        conditions, params = ["id IN (SELECT value FROM json_each(?))"], [json.dumps(ids)]
+    else:
+        conditions, params = admin_conditions(ADMIN_TABLES[table], body)
+        if not conditions and body.get('all') is not True:
+            return None
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT id FROM {table} {where} ORDER BY id LIMIT ?", params + [MAX_BULK_ROWS + 1])
+    ids = [row[0] for row in cursor.fetchall()]
+    remaining = 0
+    if len(ids) > MAX_BULK_ROWS:
+        ids = ids[:MAX_BULK_ROWS]
+        cursor.execute(f"SELECT COUNT(*) FROM {table} {where}", params)
+        remaining = cursor.fetchone()[0] - MAX_BULK_ROWS
+    return ids, remaining
+
+def approve_pending(cursor, table, ids):
+    # Move the listed pending rows with one INSERT ... SELECT and one DELETE,
+    # then do once for the whole batch what approve_donor/approve_recipient
+    # do per row: geo vectors, notification cursors and stored scores.
+    # Returns the new rows as score_donor_rows/score_recipient_rows take them.
+    from geo import unit_vectors
+    from scores import (DONOR_COLUMNS, RECIPIENT_COLUMNS, mark_scored, score_donor_rows, score_recipient_rows,
+                        save_scores)
+
+    target, columns = PENDING_TABLES[table]
+    organ_column = 'organ' if target == 'donors' else 'needed_organ'
+    returned = DONOR_COLUMNS if target == 'donors' else RECIPIENT_COLUMNS
+    selected = json.dumps(ids)
+    cursor.execute(f"""
+        INSERT INTO {target} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM {table}
+        WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+        RETURNING {returned}, {organ_column}, blood_type
+    """, (selected,))
+    rows = cursor.fetchall()
+    cursor.execute(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (selected,))
+    if not rows:
+        return rows
+
+    # Geo vectors for the whole batch in one numpy call
+    lat_index = 2 if target == 'donors' else 3
+    vectors = unit_vectors([row[lat_index] for row in rows], [row[lat_index + 1] for row in rows])
+    cursor.executemany(f"UPDATE {target} SET geo_x = ?, geo_y = ?, geo_z = ? WHERE id = ?",
+                       [tuple(vector) + (row[0],) for vector, row in zip(vectors.tolist(), rows)])
+    geo_index = lat_index + 2
+    rows = [row[:geo_index] + tuple(vector) + row[geo_index + 3:] for row, vector in zip(rows, vectors.tolist())]
+
+    new_ids = json.dumps([row[0] for row in rows])
+    model, scaler, model_version = get_model()
+    if target == 'donors':
+        save_scores(cursor, score_donor_rows(cursor, model, scaler, rows), model_version)
+    else:
+        # Topic notifications published from now on reach these recipients
+        cursor.execute("""
+            INSERT OR REPLACE INTO notification_cursors (user_id, subscribed_from)
+            SELECT value, (SELECT COALESCE(MAX(id), 0) FROM notification_events) FROM json_each(?)
+        """, (new_ids,))
+        save_scores(cursor, score_recipient_rows(cursor, model, scaler, rows), model_version)
+        mark_scored(cursor, [row[0] for row in rows], model_version)
+    return rows
+
+@app.route('/admin/approve/<table>', methods=['POST'])
+def bulk_approve(table):
+    # Approve many pending donors or recipients in one transaction. JSON body
+    # as select_pending takes; responds with the new donor/recipient ids.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    if table not in PENDING_TABLES:
+        return jsonify({"success": False, "message": "Unknown table"}), 404
+    body = request.get_json(silent=True) or {}
+
+    connection = get_db()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("BEGIN")
+        selection = select_pending(cursor, table, body)
+        if selection is None:
+            connection.rollback()
+            return jsonify({"success": False, "message": "Expected ids, filters or all"}), 400
+        ids, remaining = selection
+        rows = approve_pending(cursor, table, ids)
+        connection.commit()
+    except sqlite3.Error as e:
+        connection.rollback()
+        print(f"Error: {e}")
+        return jsonify({"success": False, "message": "Bulk approval failed"}), 500
+
+    # Cached match lists go stale once per organ (donors) or per new recipient
+    if table == 'pre_donors':
+        for organ in {row[7] for row in rows}:
+            match_cache.invalidate_organ(organ)
+    else:
+        for row in rows:
+            match_cache.invalidate_recipient(row[0])
+    return jsonify({"success": True, "approved": len(rows), "ids": [row[0] for row in rows],
+                    "remaining": remaining})
+
+@app.route('/admin/reject/<table>', methods=['POST'])
+def bulk_reject(table):
+    # Drop many pending donors or recipients with one DELETE; same body as
+    # /admin/approve/<table>. Their user accounts are kept.
+    if not session.get('admin_logged_in'):
+        return jsonify({"success": False, "message": "Admin login required"}), 403
+    if table not in PENDING_TABLES:
+        return jsonify({"success": False, "message": "Unknown table"}), 404
+    body = request.get_json(silent=True) or {}
+
+    connection = get_db()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("BEGIN")
+        selection = select_pending(cursor, table, body)
+        if selection is None:
+            connection.rollback()
+            return jsonify({"success": False, "message": "Expected ids, filters or all"}), 400
+        ids, remaining = selection
+        cursor.execute(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+        rejected = cursor.rowcount
+        connection.commit()
+    except sqlite3.Error as e:
+        connection.rollback()
+        print(f"Error: {e}")
+        return jsonify({"success": False, "message": "Bulk rejection failed"}), 500
+    return jsonify({"success": True, "rejected": rejected, "remaining": remaining})
 
 @app.route('/delete_user/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
-    connection = sqlite3.connect(DB_FILE)
+    connection = get_db()
     cursor = connection.cursor()
     
     try:
@@ -641,6 +1354,12 @@ def delete_user(user_id):
         user_email = cursor.fetchone()
         
         if user_email:
+            # Remember what the deletes touch so cached match lists can be dropped
+            cursor.execute("SELECT DISTINCT organ FROM donors WHERE email = ?", (user_email[0],))
+            donor_organs = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT id FROM recipients WHERE email = ?", (user_email[0],))
+            deleted_recipient_ids = [row[0] for row in cursor.fetchall()]
+
             # Delete from donors if exists
             cursor.execute("DELETE FROM donors WHERE email = ?", (user_email[0],))
             
@@ -657,20 +1376,25 @@ def delete_user(user_id):
             cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
             
             connection.commit()
+            for organ in donor_organs:
+                match_cache.invalidate_organ(organ)
+            for deleted_recipient_id in deleted_recipient_ids:
+                match_cache.invalidate_recipient(deleted_recipient_id)
             print(f"User {user_email[0]} deleted from all tables")
         
     except sqlite3.Error as e:
         connection.rollback()
         print(f"Error: {e}")
         
-    finally:
-        connection.close()
         
     return redirect(url_for('admin_panel'))
 
 @app.route('/approve_donor/<int:donor_id>', methods=['POST'])
 def approve_donor(donor_id):
-    connection = sqlite3.connect(DB_FILE)
+    from geo import unit_vector
+    from scores import score_donor, save_scores
+
+    connection = get_db()
     cursor = connection.cursor()
     
     # Get donor data
@@ -681,20 +1405,30 @@ def approve_donor(donor_id):
         # Insert into main donors table
         cursor.execute("""
             INSERT INTO donors 
-            (full_name, email, blood_type, organ, age, longitude, latitude)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, donor[1:])  # Exclude ID
+            (full_name, email, blood_type, organ, age, longitude, latitude, geo_x, geo_y, geo_z)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, donor[1:] + unit_vector(donor[7], donor[6]))  # Exclude ID
+        new_donor_id = cursor.lastrowid
+
+        # Score the new donor against every recipient needing this organ
+        model, scaler, model_version = get_model()
+        save_scores(cursor, score_donor(cursor, model, scaler, new_donor_id), model_version)
         
         # Delete from pre_donors
         cursor.execute("DELETE FROM pre_donors WHERE id = ?", (donor_id,))
         connection.commit()
+
+        # Every recipient needing this organ has a new candidate
+        match_cache.invalidate_organ(donor[4])
         
-    connection.close()
     return redirect(url_for('admin_panel'))
 
 @app.route('/approve_recipient/<int:recipient_id>', methods=['POST']) 
 def approve_recipient(recipient_id):
-    connection = sqlite3.connect(DB_FILE)
+    from geo import unit_vector
+    from scores import mark_scored, score_recipient, save_scores
+
+    connection = get_db()
     cursor = connection.cursor()
     
     cursor.execute("SELECT * FROM pre_recipients WHERE id = ?", (recipient_id,))
@@ -703,33 +1437,29 @@ def approve_recipient(recipient_id):
     if recipient:
         cursor.execute("""
             INSERT INTO recipients
-            (full_name, email, blood_type, needed_organ, urgency_level, age, longitude, latitude)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, recipient[1:])
+            (full_name, email, blood_type, needed_organ, urgency_level, age, longitude, latitude,
+             geo_x, geo_y, geo_z)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, recipient[1:] + unit_vector(recipient[8], recipient[7]))
+        new_recipient_id = cursor.lastrowid
+
+        # Topic notifications published from now on reach this recipient
+        cursor.execute("""
+            INSERT OR REPLACE INTO notification_cursors (user_id, subscribed_from)
+            VALUES (?, (SELECT COALESCE(MAX(id), 0) FROM notification_events))
+        """, (new_recipient_id,))
+
+        # Score every donor of the needed organ against the new recipient
+        model, scaler, model_version = get_model()
+        save_scores(cursor, score_recipient(cursor, model, scaler, new_recipient_id), model_version)
+        mark_scored(cursor, [new_recipient_id], model_version)
         
         cursor.execute("DELETE FROM pre_recipients WHERE id = ?", (recipient_id,))
         connection.commit()
+        match_cache.invalidate_recipient(new_recipient_id)
         
-    connection.close()
     return redirect(url_for('admin_panel'))
 
-def create_matches_table():
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
-    cursor.execute('''CREATE TABLE IF NOT EXISTS matches
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         donor_id INTEGER,
-         recipient_id INTEGER,
-         match_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-         donor_name TEXT,
-         recipient_name TEXT,
-         organ TEXT,
-         FOREIGN KEY (donor_id) REFERENCES donors (id),
-         FOREIGN KEY (recipient_id) REFERENCES recipients (id))
-    ''')
-    connection.commit()
-    connection.close()
-
 # Define a WebSocket route
 @socketio.on('connect', namespace='/ws')
 def handle_connect():
@@ -743,14 +1473,48 @@ def handle_disconnect():
 # In app.py, add room management:
 @socketio.on('join')
 def on_join(data):
+    # A client rejoining after a disconnect sends the last seq it applied
+    # and is sent the events it missed. Without one, or when the log no
+    # longer covers the gap, it is told to resync (reload in full) from the
+    # room's current seq.
     room = data['room']
     join_room(room)
+    last_seq = data.get('last_seq')
+    if last_seq is not None:
+        missed, complete = event_log.replay(room, int(last_seq))
+        if complete:
+            for event, payload in missed:
+                emit(event, payload)
+            return
+    emit('resync', {'room': room, 'seq': event_log.last_seq(room)})
     
 @socketio.on('leave')
 def on_leave(data):
     room = data['room'] 
     leave_room(room)
 
+def warmup():
+    # Pay every first-request cost now: model artifacts, NumPy-backed
+    # modules, a tuned pooled connection and compiled templates
+    get_model()
+    import geo, scores  # noqa: F401
+    with db_pool.connection():
+        pass
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+
+# WARMUP=1 warms up before the worker serves anything (use with gunicorn);
+# WARMUP=background does it on a thread while the worker starts serving
+if os.environ.get('WARMUP') == 'background':
+    threading.Thread(target=warmup, name='warmup', daemon=True).start()
+elif os.environ.get('WARMUP'):
+    warmup()
+
 if __name__ == '__main__':
-    create_matches_table()
+    parser = argparse.ArgumentParser(description="Run the LifeLink server")
+    parser.add_argument('--warmup', action='store_true',
+                        help="load the model and open connections before accepting requests")
+    args = parser.parse_args()
+    if args.warmup:
+        warmup()
     socketio.run(app, debug=True)
@@ -0,0 +1,69 @@
+import os
+import queue
+import threading
+import time
+import traceback
+
+
+class TaskQueue:
+    # Runs slow side effects (notification fan-out and the like) on a worker
+    # thread so the request that triggered them can return immediately.
+    # Keeps per-task counters and timings for the stats endpoint.
+    def __init__(self, name='background'):
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self._stats = {}
+
+    def _ensure_worker(self):
+        # Threads don't survive a fork, so each worker process starts its own
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue()
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._worker.start()
+
+    def submit(self, task_name, function, *args, **kwargs):
+        self._ensure_worker()
+        with self._lock:
+            stats = self._stats.setdefault(task_name, {
+                'submitted': 0, 'completed': 0, 'failed': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0, 'last_seconds': None,
+            })
+            stats['submitted'] += 1
+        self._queue.put((task_name, function, args, kwargs))
+
+    def _run(self):
+        while True:
+            task_name, function, args, kwargs = self._queue.get()
+            start = time.perf_counter()
+            failed = False
+            try:
+                function(*args, **kwargs)
+            except Exception:
+                failed = True
+                print(f"Background task {task_name} failed:")
+                traceback.print_exc()
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._stats[task_name]
+                stats['failed' if failed else 'completed'] += 1
+                stats['total_seconds'] += elapsed
+                stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+                stats['last_seconds'] = elapsed
+            self._queue.task_done()
+
+    def join(self):
+        # Block until everything submitted so far has run
+        self._queue.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'tasks': {name: dict(stats) for name, stats in self._stats.items()},
+            }
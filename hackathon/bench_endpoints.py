@@ -0,0 +1,176 @@
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import time
+from synthetic import generate
+
+# Latency of the hot endpoints through the Flask test client, against a
+# copy of a (usually synthetic) database:
+#
+#   python synthetic.py --db /tmp/bench.db --donors 100000 --recipients 10000
+#   python bench_endpoints.py --db /tmp/bench.db --json results/100k.json
+#
+# or generate one on the fly with --donors/--recipients. Requests run one at
+# a time, so throughput is single-client requests per second.
+
+ENDPOINTS = ('match', 'map_matches', 'send_request', 'requests', 'notifications', 'admin')
+
+
+def sample(db_file, count, seed):
+    # Random ids to request, and donor/recipient pairs with no request yet
+    rng = random.Random(seed)
+    connection = sqlite3.connect(db_file)
+    cursor = connection.cursor()
+    cursor.execute("SELECT id FROM recipients")
+    recipients = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT id FROM donors")
+    donors = [row[0] for row in cursor.fetchall()]
+    cursor.execute("""
+        SELECT d.id, r.id FROM recipients r JOIN donors d ON d.organ = r.needed_organ
+        WHERE r.id IN (SELECT id FROM recipients ORDER BY random() LIMIT ?)
+          AND NOT EXISTS (SELECT 1 FROM requests q WHERE q.donor_id = d.id AND q.recipient_id = r.id)
+        GROUP BY r.id
+    """, (count,))
+    pairs = cursor.fetchall()
+    connection.close()
+    if not recipients or not donors:
+        raise SystemExit("The database has no donors or recipients; run synthetic.py first")
+    return ([rng.choice(recipients) for _ in range(count)],
+            [rng.choice(donors) for _ in range(count)],
+            pairs)
+
+
+def build_calls(recipients, donors, pairs):
+    # endpoint -> [(method, path, json body)]
+    return {
+        'match': [('GET', f'/match/{r}', None) for r in recipients],
+        'map_matches': [('GET', f'/map-matches/{r}', None) for r in recipients],
+        'send_request': [('POST', '/send_request', {'donor_id': d, 'recipient_id': r}) for d, r in pairs],
+        'requests': [('GET', f'/requests/{d}', None) for d in donors],
+        'notifications': [('GET', f'/notifications/{r}', None) for r in recipients],
+        'admin': [('GET', '/admin', None) for _ in recipients],
+    }
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run(client, calls, warmup):
+    for method, path, body in calls[:warmup]:
+        client.open(path, method=method, json=body)
+    timings, errors = [], 0
+    started = time.perf_counter()
+    for method, path, body in calls[warmup:]:
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body)
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            errors += 1
+    wall = time.perf_counter() - started
+    timings.sort()
+    return {
+        'requests': len(timings),
+        'errors': errors,
+        'p50_ms': percentile(timings, 50) * 1000 if timings else None,
+        'p95_ms': percentile(timings, 95) * 1000 if timings else None,
+        'p99_ms': percentile(timings, 99) * 1000 if timings else None,
+        'mean_ms': sum(timings) / len(timings) * 1000 if timings else None,
+        'throughput_rps': len(timings) / wall if wall else None,
+    }
+
+
+def table_counts(db_file):
+    connection = sqlite3.connect(db_file)
+    counts = {table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for table in ('donors', 'recipients', 'users', 'requests', 'matches', 'pre_donors',
+                            'pre_recipients', 'notification_events')}
+    connection.close()
+    return counts
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hot endpoints with the Flask test client")
+    parser.add_argument('--db', help="database to copy for the run (default: generate one)")
+    parser.add_argument('--donors', type=int, default=10000, help="donors to generate when --db is not given")
+    parser.add_argument('--recipients', type=int, default=1000, help="recipients to generate when --db is not given")
+    parser.add_argument('--requests', type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument('--warmup', type=int, default=10, help="untimed requests per endpoint first")
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help="also write the results to FILE")
+    parser.add_argument('--compare', metavar='FILE', help="print the change from an earlier --json result")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'bench.db')
+        if args.db:
+            shutil.copy(args.db, db_file)
+        else:
+            generate(db_file, args.donors, args.recipients, 0.01, 3.0, args.seed)
+
+        # app reads DB_FILE at import
+        os.environ['DB_FILE'] = db_file
+        import app
+        client = app.app.test_client()
+        with client.session_transaction() as session:
+            session['admin_logged_in'] = True
+
+        total = args.requests + args.warmup
+        calls = build_calls(*sample(db_file, total, args.seed))
+        results = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'commit': git_commit(),
+                'python': platform.python_version(),
+                'requests_per_endpoint': args.requests,
+                'warmup_per_endpoint': args.warmup,
+                'tables': table_counts(db_file),
+            },
+            'endpoints': {},
+        }
+        for endpoint in args.endpoints:
+            results['endpoints'][endpoint] = run(client, calls[endpoint], args.warmup)
+            summary = results['endpoints'][endpoint]
+            if summary['requests']:
+                print(f"{endpoint:<14} p50 {summary['p50_ms']:8.2f} ms  p95 {summary['p95_ms']:8.2f} ms  "
+                      f"p99 {summary['p99_ms']:8.2f} ms  {summary['throughput_rps']:8.1f} req/s  "
+                      f"({summary['requests']} requests, {summary['errors']} errors)")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline['meta'].get('commit')}):")
+        for endpoint, summary in results['endpoints'].items():
+            before = baseline['endpoints'].get(endpoint)
+            if not before or not before['p50_ms'] or not summary['p50_ms']:
+                continue
+            changes = '  '.join(f"{key[:-3]} {(summary[key] / before[key] - 1) * 100:+6.1f}%"
+                                for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+            print(f"    {endpoint:<14} {changes}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
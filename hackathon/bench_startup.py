@@ -0,0 +1,135 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from geo import unit_vector
+from migrations import migrate
+
+# Runs inside a fresh interpreter: imports app, then times the first request
+# to each path. Times are reported relative to BENCH_SPAWNED_AT, the moment
+# the parent started the process.
+FIRST_RESPONSE_SCRIPT = '''
+import json, os, sys, time
+spawned_at = float(os.environ['BENCH_SPAWNED_AT'])
+timings = {'interpreter_ready_s': time.time() - spawned_at}
+start = time.perf_counter()
+import app
+timings['import_app_s'] = time.perf_counter() - start
+client = app.app.test_client()
+for path in sys.argv[1:]:
+    response = client.get(path)
+    timings[path] = {'status': response.status_code,
+                     'time_to_first_response_s': time.time() - spawned_at}
+print(json.dumps(timings))
+'''
+
+
+def seed_database(source, target):
+    # Copy of the fixture database with at least one donor/recipient pair, so
+    # /match/<id> does real work. Returns a recipient id.
+    shutil.copy(source, target)
+    migrate(target)
+    connection = sqlite3.connect(target)
+    cursor = connection.cursor()
+    cursor.execute("""
+        SELECT r.id FROM recipients r
+        WHERE EXISTS (SELECT 1 FROM donors d WHERE d.organ = r.needed_organ)
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        cursor.execute("""
+            INSERT INTO donors (full_name, email, blood_type, organ, age, longitude, latitude,
+                                geo_x, geo_y, geo_z)
+            VALUES ('Bench Donor', 'bench-donor@example.com', 'O+', 'Kidney', 35, 77.59, 12.97, ?, ?, ?)
+        """, unit_vector(12.97, 77.59))
+        cursor.execute("""
+            INSERT INTO recipients (full_name, email, blood_type, needed_organ, urgency_level, age,
+                                    longitude, latitude, geo_x, geo_y, geo_z)
+            VALUES ('Bench Recipient', 'bench-recipient@example.com', 'O+', 'Kidney', 4, 40, 77.21, 28.61,
+                    ?, ?, ?)
+        """, unit_vector(28.61, 77.21))
+        row = (cursor.lastrowid,)
+        connection.commit()
+    connection.close()
+    return row[0]
+
+
+def import_time(env):
+    # Total and heaviest top-level imports from python -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'],
+                            env=env, capture_output=True, text=True, check=True)
+    top_level = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name[1:].startswith(' '):  # no indentation: imported by the script itself
+            top_level.append((name.strip(), int(cumulative) / 1e6))
+    top_level.sort(key=lambda item: item[1], reverse=True)
+    return {'total_s': sum(seconds for _, seconds in top_level),
+            'heaviest': [{'module': name, 'cumulative_s': seconds} for name, seconds in top_level[:10]]}
+
+
+def first_responses(env, paths):
+    env = dict(env, BENCH_SPAWNED_AT=repr(time.time()))
+    result = subprocess.run([sys.executable, '-c', FIRST_RESPONSE_SCRIPT, *paths],
+                            env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs, paths):
+    summary = {key: statistics.median(run[key] for run in runs)
+               for key in ('interpreter_ready_s', 'import_app_s')}
+    for path in paths:
+        summary[path] = {
+            'status': runs[-1][path]['status'],
+            'time_to_first_response_s': statistics.median(run[path]['time_to_first_response_s']
+                                                          for run in runs),
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time and time to first response")
+    parser.add_argument('--db', default='organ_donation.db', help="database to copy for the run")
+    parser.add_argument('--runs', type=int, default=5, help="processes to start per mode (median reported)")
+    parser.add_argument('--json', metavar='FILE', help="also write the results to FILE")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, 'bench.db')
+        recipient_id = seed_database(args.db, db_file)
+        paths = ['/', f'/match/{recipient_id}']
+        env = dict(os.environ, DB_FILE=db_file)
+        env.pop('WARMUP', None)
+
+        results = {'import_time': import_time(env), 'first_response': {}}
+        for mode, warmup in (('lazy', None), ('warmup', '1')):
+            mode_env = dict(env, WARMUP=warmup) if warmup else env
+            runs = [first_responses(mode_env, paths) for _ in range(args.runs)]
+            results['first_response'][mode] = summarize(runs, paths)
+
+    print(f"python -X importtime, import app: {results['import_time']['total_s'] * 1000:.0f} ms")
+    for entry in results['import_time']['heaviest']:
+        print(f"    {entry['module']:<30} {entry['cumulative_s'] * 1000:8.1f} ms")
+    for mode, summary in results['first_response'].items():
+        print(f"{mode}: interpreter {summary['interpreter_ready_s'] * 1000:.0f} ms, "
+              f"import app {summary['import_app_s'] * 1000:.0f} ms")
+        for path in paths:
+            print(f"    first {path:<16} {summary[path]['time_to_first_response_s'] * 1000:8.1f} ms "
+                  f"after spawn (HTTP {summary[path]['status']})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
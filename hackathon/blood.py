@@ -0,0 +1,62 @@
+import numpy as np
+
+# ABO/Rh compatibility between donor and recipient blood types, as one
+# bitmask per label_encoder class: bit j of MASKS[i] is set when a recipient
+# of class i can receive from a donor of class j. Candidate queries select
+# only donors of compatible types, so the rest are never scored.
+
+# label_encoder.classes_ (LabelEncoder keeps them sorted, see new.py)
+CLASSES = ('A+', 'A-', 'AB+', 'AB-', 'B+', 'B-', 'O+', 'O-')
+
+# Part of the version stored with every score (see scores.artifact_version);
+# change it when the rule below changes so stored scores are recomputed
+RULES = 'abo-rh-1'
+
+ANTIGENS = {'O': set(), 'A': {'A'}, 'B': {'B'}, 'AB': {'A', 'B'}}
+
+
+def can_receive(recipient_type, donor_type):
+    # The donor carries no ABO antigen the recipient lacks, and an Rh-
+    # recipient only receives from Rh- donors
+    recipient_abo, recipient_rh = recipient_type[:-1], recipient_type[-1:]
+    donor_abo, donor_rh = donor_type[:-1], donor_type[-1:]
+    if recipient_abo not in ANTIGENS or donor_abo not in ANTIGENS:
+        return False
+    return ANTIGENS[donor_abo] <= ANTIGENS[recipient_abo] and (donor_rh == '-' or recipient_rh == '+')
+
+
+def compatibility_masks(classes=CLASSES):
+    return tuple(sum(1 << j for j, donor in enumerate(classes) if can_receive(recipient, donor))
+                 for recipient in classes)
+
+
+MASKS = compatibility_masks()
+
+
+def donor_types(recipient_type):
+    # Blood types a recipient can receive from; none for an unknown type
+    if recipient_type not in CLASSES:
+        return []
+    mask = MASKS[CLASSES.index(recipient_type)]
+    return [donor for j, donor in enumerate(CLASSES) if mask >> j & 1]
+
+
+def recipient_types(donor_type):
+    # Blood types that can receive from a donor
+    if donor_type not in CLASSES:
+        return []
+    j = CLASSES.index(donor_type)
+    return [recipient for i, recipient in enumerate(CLASSES) if MASKS[i] >> j & 1]
+
+
+def encode(blood_types):
+    # Class indices as label_encoder.transform gives them, with unknown types
+    # mapped to len(CLASSES), a bit no mask has set
+    index = {blood_type: i for i, blood_type in enumerate(CLASSES)}
+    return np.array([index.get(blood_type, len(CLASSES)) for blood_type in blood_types], dtype=np.int64)
+
+
+def compatible(recipient_classes, donor_classes):
+    # (R, D) boolean matrix from encoded recipient and donor types
+    masks = np.array(MASKS + (0,), dtype=np.int64)[recipient_classes]
+    return ((masks[:, None] >> donor_classes[None, :]) & 1).astype(bool)
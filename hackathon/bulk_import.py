@@ -0,0 +1,190 @@
+import argparse
+import csv
+import io
+import json
+import os
+import sqlite3
+import time
+
+# Bulk registration: streams CSV or JSONL into pre_donors / pre_recipients,
+# where rows wait for admin approval exactly like /submit registrations.
+#
+#   python bulk_import.py donors.csv --kind donor --rejects rejects.jsonl
+#
+# Input is read and inserted BATCH_SIZE rows at a time, one transaction per
+# batch, so memory stays flat however large the file is.
+
+# SQLite database file name
+DB_FILE = 'organ_donation.db'
+
+BATCH_SIZE = 10000
+
+# Columns per kind, in insert order. Aliases let files exported from the
+# registration form (fullName, bloodType, ...) load unchanged.
+COLUMNS = {
+    'donor': ('full_name', 'email', 'blood_type', 'organ', 'age', 'longitude', 'latitude'),
+    'recipient': ('full_name', 'email', 'blood_type', 'needed_organ', 'urgency_level', 'age',
+                  'longitude', 'latitude'),
+}
+TABLES = {'donor': 'pre_donors', 'recipient': 'pre_recipients'}
+ALIASES = {
+    'fullName': 'full_name', 'name': 'full_name',
+    'bloodType': 'blood_type',
+    'organs': 'organ',
+    'neededOrgan': 'needed_organ',
+    'urgencyLevel': 'urgency_level', 'urgency': 'urgency_level',
+    'lon': 'longitude', 'lng': 'longitude',
+    'lat': 'latitude',
+}
+URGENCY_LEVELS = range(1, 5)
+
+
+def blood_type_classes(path='label_encoder.pkl'):
+    # The blood types the model pipeline knows, from the fitted LabelEncoder
+    import joblib
+    return set(joblib.load(path).classes_)
+
+
+def detect_format(filename):
+    return 'jsonl' if os.path.splitext(filename)[1].lower() in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+def read_records(stream, file_format):
+    # (line number, dict) for every record in a text stream, one at a time.
+    # Unparseable JSONL lines come through as (line, None).
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+def validate(record, kind, blood_types):
+    # (row tuple, None) if the record is valid, else (None, reason)
+    if record is None:
+        return None, 'unparseable'
+    values = {ALIASES.get(key, key): value for key, value in record.items()}
+    row = []
+    for column in COLUMNS[kind]:
+        value = values.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            return None, f'missing {column}'
+        try:
+            if column == 'blood_type':
+                value = value.upper()
+                if value not in blood_types:
+                    return None, 'unknown blood_type'
+            elif column in ('age', 'urgency_level'):
+                value = int(value)
+                if column == 'age' and not 0 <= value <= 120:
+                    return None, 'age out of range'
+                if column == 'urgency_level' and value not in URGENCY_LEVELS:
+                    return None, 'urgency_level out of range'
+            elif column in ('longitude', 'latitude'):
+                value = float(value)
+                limit = 180 if column == 'longitude' else 90
+                if not -limit <= value <= limit:
+                    return None, f'{column} out of range'
+            elif not isinstance(value, str):
+                return None, f'invalid {column}'
+        except (AttributeError, TypeError, ValueError):
+            # AttributeError: a JSONL blood_type that is not a string
+            return None, f'invalid {column}'
+        row.append(value)
+    return tuple(row), None
+
+
+def import_batches(connection, records, kind, blood_types, batch_size=BATCH_SIZE, on_reject=None):
+    # Insert valid records, batch_size per transaction, yielding the running
+    # summary after each commit (at least once). on_reject(line, reason,
+    # record) is called for every record that fails validation.
+    columns = COLUMNS[kind]
+    query = (f"INSERT INTO {TABLES[kind]} ({', '.join(columns)}) "
+             f"VALUES ({', '.join('?' * len(columns))})")
+    summary = {'read': 0, 'inserted': 0, 'rejected': 0, 'reasons': {}, 'seconds': 0.0}
+    started = time.perf_counter()
+    batch = []
+    cursor = connection.cursor()
+
+    for line_number, record in records:
+        summary['read'] += 1
+        row, reason = validate(record, kind, blood_types)
+        if row is None:
+            summary['rejected'] += 1
+            summary['reasons'][reason] = summary['reasons'].get(reason, 0) + 1
+            if on_reject:
+                on_reject(line_number, reason, record)
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            cursor.execute("BEGIN")
+            cursor.executemany(query, batch)
+            cursor.execute("COMMIT")
+            summary['inserted'] += len(batch)
+            summary['seconds'] = time.perf_counter() - started
+            batch.clear()
+            yield summary
+
+    if batch:
+        cursor.execute("BEGIN")
+        cursor.executemany(query, batch)
+        cursor.execute("COMMIT")
+        summary['inserted'] += len(batch)
+    summary['seconds'] = time.perf_counter() - started
+    yield summary
+
+
+def open_input(path, file_format=None):
+    # Text stream over a file; newline='' as the csv module expects
+    return open(path, newline='', encoding='utf-8-sig'), file_format or detect_format(path)
+
+
+def text_stream(binary_stream):
+    return io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk-import donors or recipients awaiting approval")
+    parser.add_argument('file', help="CSV (with a header row) or JSONL file")
+    parser.add_argument('--kind', choices=sorted(COLUMNS), required=True)
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="default: from the file extension")
+    parser.add_argument('--db', default=DB_FILE, help="database file")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--rejects', metavar='FILE', help="write rejected records here as JSONL")
+    args = parser.parse_args()
+
+    from migrations import migrate
+    migrate(args.db)
+    connection = sqlite3.connect(args.db, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA busy_timeout=5000")
+    rejects = open(args.rejects, 'w') if args.rejects else None
+
+    def reject(line_number, reason, record):
+        if rejects:
+            rejects.write(json.dumps({'line': line_number, 'reason': reason, 'record': record}) + '\n')
+
+    stream, file_format = open_input(args.file, args.format)
+    with stream:
+        for summary in import_batches(connection, read_records(stream, file_format), args.kind,
+                                      blood_type_classes(), args.batch_size, reject):
+            print(f"{summary['read']} read, {summary['inserted']} inserted, {summary['rejected']} rejected "
+                  f"({summary['read'] / max(summary['seconds'], 1e-9):.0f} rows/s)", flush=True)
+    if rejects:
+        rejects.close()
+    connection.close()
+
+    print(f"Done: {summary['inserted']} inserted into {TABLES[args.kind]}, {summary['rejected']} rejected "
+          f"in {summary['seconds']:.1f}s")
+    for reason, count in sorted(summary['reasons'].items(), key=lambda item: -item[1]):
+        print(f"    {reason:<28} {count}")
@@ -1,76 +1,75 @@
+import os
+import queue
 import sqlite3
+from contextlib import contextmanager
+from migrations import migrate
 
 # SQLite database file name
 DB_FILE = 'organ_donation.db'
 
-def create_tables():
-    connection = sqlite3.connect(DB_FILE)
-    cursor = connection.cursor()
+# Applied once when a pooled connection is opened. WAL lets readers run
+# alongside the single writer, and busy_timeout makes a writer wait for the
+# lock instead of failing with "database is locked".
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",      # ~20 MB page cache per connection
+    "PRAGMA mmap_size=268435456",    # 256 MB
+)
+
 
-    # Create users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            password TEXT,
-            user_type TEXT
-        )
-    ''')
+class ConnectionPool:
+    # Keeps tuned connections open between requests. Each connection carries
+    # sqlite3's prepared-statement cache, so reusing it also reuses the
+    # compiled statements.
+    def __init__(self, db_file=DB_FILE, size=16, cached_statements=256, factory=sqlite3.Connection):
+        self.db_file = db_file
+        self.size = size
+        self.cached_statements = cached_statements
+        self.factory = factory
+        self._idle = queue.LifoQueue()
+        self._pid = os.getpid()
 
-    # Create donors table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS donors (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT,
-            email TEXT,
-            blood_type TEXT,
-            organ TEXT,
-            age INTEGER,
-            longitude REAL,
-            latitude REAL
-        )
-    ''')
+    def _connect(self):
+        connection = sqlite3.connect(self.db_file, check_same_thread=False,
+                                     cached_statements=self.cached_statements, factory=self.factory)
+        connection.row_factory = sqlite3.Row  # Allows dict-like access to rows
+        for pragma in CONNECTION_PRAGMAS:
+            connection.execute(pragma)
+        return connection
 
-    # Create recipients table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS recipients (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            full_name TEXT,
-            email TEXT,
-            blood_type TEXT,
-            needed_organ TEXT,
-            urgency_level INTEGER,
-            age INTEGER,
-            longitude REAL,
-            latitude REAL
-        )
-    ''')
+    def acquire(self):
+        # Connections must not cross a fork, so a child process starts empty
+        if os.getpid() != self._pid:
+            self._idle = queue.LifoQueue()
+            self._pid = os.getpid()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self._connect()
 
-    # Create notifications table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message TEXT,
-            type TEXT,
-            FOREIGN KEY (user_id) REFERENCES recipients(id)
-        )
-    ''')
+    def release(self, connection):
+        # Never hand out a connection with a transaction left open
+        if connection.in_transaction:
+            connection.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            connection.close()
 
-    # Create requests table
-    cursor.execute('''CREATE TABLE IF NOT EXISTS requests (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        donor_id INTEGER NOT NULL,
-        recipient_id INTEGER NOT NULL,
-        status TEXT DEFAULT 'pending',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (donor_id) REFERENCES donors(id),
-        FOREIGN KEY (recipient_id) REFERENCES recipients(id)
-    )''')
+    @contextmanager
+    def connection(self):
+        # For code running outside a Flask request (scripts, background work)
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
 
-    connection.commit()
-    cursor.close()
-    connection.close()
+def create_tables():
+    # Table definitions live in migrations.py; this applies any that are missing
+    migrate(DB_FILE)
     print("Database and tables created successfully.")
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+import json
+import threading
+from collections import OrderedDict, deque
+
+
+class EventLog:
+    # Bounded per-room history of Socket.IO events, so a client that
+    # reconnects can be sent what it missed instead of refetching everything.
+    #
+    # Every room numbers its events 1, 2, 3, ...; a client remembers the last
+    # seq it applied and sends it back when it rejoins. Only the newest
+    # max_events of a room are kept, and only the max_rooms most recently
+    # used rooms. When the gap can't be covered (history dropped, or the
+    # server restarted and numbering began again) replay() says so and the
+    # client falls back to a full load. The log is per process.
+    def __init__(self, max_events=100, max_rooms=10000):
+        self.max_events = max_events
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()  # room -> [last seq, deque of (seq, event, payload)]
+        self._lock = threading.Lock()
+
+    def append(self, room, event, payload):
+        # The payload with this room's next seq added
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry is None:
+                entry = self._rooms[room] = [0, deque(maxlen=self.max_events)]
+                while len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            self._rooms.move_to_end(room)
+            entry[0] += 1
+            payload = dict(payload, seq=entry[0])
+            entry[1].append((entry[0], event, payload))
+            return payload
+
+    def last_seq(self, room):
+        with self._lock:
+            entry = self._rooms.get(room)
+            return entry[0] if entry else 0
+
+    def replay(self, room, last_seq):
+        # (events after last_seq as (event, payload) pairs, complete). When
+        # complete is False the events are not enough to catch up.
+        with self._lock:
+            entry = self._rooms.get(room)
+            if entry is None:
+                return [], last_seq == 0
+            current, events = entry
+            if last_seq > current:
+                return [], False
+            missed = [(event, payload) for seq, event, payload in events if seq > last_seq]
+            return missed, len(missed) == current - last_seq
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self._rooms),
+                'events': sum(len(entry[1]) for entry in self._rooms.values()),
+                'max_events': self.max_events,
+                'max_rooms': self.max_rooms,
+            }
+
+
+class SharedEventLog:
+    # EventLog kept in the socket_events table, for when several worker
+    # processes emit to the same rooms (see SOCKETIO_MESSAGE_QUEUE in app.py).
+    # Sequence numbers are assigned under the database write lock, so they
+    # stay gap-free per room whichever worker emits, and any worker can
+    # replay them.
+    def __init__(self, pool, max_events=100):
+        self.pool = pool
+        self.max_events = max_events
+
+    def append(self, room, event, payload):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM socket_events WHERE room = ?", (room,))
+            seq = cursor.fetchone()[0]
+            payload = dict(payload, seq=seq)
+            cursor.execute("INSERT INTO socket_events (room, seq, event, payload) VALUES (?, ?, ?, ?)",
+                           (room, seq, event, json.dumps(payload)))
+            cursor.execute("DELETE FROM socket_events WHERE room = ? AND seq <= ?",
+                           (room, seq - self.max_events))
+            connection.commit()
+        return payload
+
+    def last_seq(self, room):
+        with self.pool.connection() as connection:
+            row = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM socket_events WHERE room = ?",
+                                     (room,)).fetchone()
+        return row[0]
+
+    def replay(self, room, last_seq):
+        with self.pool.connection() as connection:
+            rows = connection.execute("""
+                SELECT seq, event, payload FROM socket_events
+                WHERE room = ? AND seq > ? ORDER BY seq
+            """, (room, last_seq)).fetchall()
+            current = rows[-1][0] if rows else self.last_seq(room)
+        if last_seq > current:
+            return [], False
+        missed = [(event, json.loads(payload)) for _, event, payload in rows]
+        return missed, len(missed) == current - last_seq
+
+    def stats(self):
+        with self.pool.connection() as connection:
+            rooms, events = connection.execute(
+                "SELECT COUNT(DISTINCT room), COUNT(*) FROM socket_events").fetchone()
+        return {'rooms': rooms, 'events': events, 'max_events': self.max_events}
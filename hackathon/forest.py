@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import os
+import shutil
+import numpy as np
+
+# Flattened model artifact served by app.py
+COMPILED_MODEL_FILE = 'organ_matching_model.npz'
+
+# Arrays of an artifact as stored by save(), plus the lookup grid in the
+# unpacked layout (see unpack)
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'value', 'roots', 'max_depth', 'scale', 'offset')
+
+# Largest lookup grid worth precomputing (cells)
+MAX_GRID_CELLS = 1 << 20
+
+
+class CompiledScaler:
+    # MinMaxScaler.transform without sklearn: X * scale_ + min_
+    def __init__(self, scale, offset):
+        self.scale = scale
+        self.offset = offset
+
+    def transform(self, features):
+        scaled = np.array(features, dtype=np.float64)
+        scaled *= self.scale
+        scaled += self.offset
+        return scaled
+
+
+class CompiledForest:
+    # A random forest flattened into node arrays. All trees share the arrays;
+    # roots[t] is the first node of tree t. Leaves point at themselves, so
+    # every sample can be walked max_depth steps with no per-node branching.
+    def __init__(self, feature, threshold, left, right, value, roots, max_depth, grid=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.grid = grid  # (edges per feature, cell values) or None
+
+    def predict_nodes(self, scaled):
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(scaled, dtype=np.float32).astype(np.float64)
+        return self._walk(X)
+
+    def _walk(self, X):
+        rows = np.arange(len(X))
+        nodes = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.max_depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        # Sum tree by tree, in order, as sklearn does before averaging
+        return np.add.reduce(self.value[nodes], axis=0) / len(self.roots)
+
+    def predict(self, scaled):
+        if len(scaled) == 0:
+            return np.empty(0, dtype=np.float64)
+        if self.grid is not None:
+            return self.predict_grid(scaled)
+        return self.predict_nodes(scaled)
+
+    def predict_grid(self, scaled):
+        # The forest is constant between consecutive thresholds of each
+        # feature, so a cell lookup gives exactly the tree-walk prediction
+        edges, cells = self.grid
+        X = np.asarray(scaled, dtype=np.float32).astype(np.float64)
+        index = np.zeros(len(X), dtype=np.int64)
+        for f, feature_edges in enumerate(edges):
+            index = index * (len(feature_edges) + 1) + np.searchsorted(feature_edges, X[:, f], side='left')
+        return cells[index]
+
+    def build_grid(self, n_features, max_cells=MAX_GRID_CELLS):
+        edges = []
+        for f in range(n_features):
+            is_split = (self.feature == f) & (self.left != np.arange(len(self.left)))
+            edges.append(np.unique(self.threshold[is_split]))
+        shape = [len(feature_edges) + 1 for feature_edges in edges]
+        if np.prod(shape, dtype=np.float64) > max_cells:
+            return None
+
+        # One representative point per cell: the cell's upper threshold, or
+        # just past the last threshold for the open-ended top cell
+        axes = [np.append(feature_edges, feature_edges[-1] + 1 if len(feature_edges) else 0.0)
+                for feature_edges in edges]
+        points = np.stack([axis.ravel() for axis in np.meshgrid(*axes, indexing='ij')], axis=1)
+        self.grid = (edges, self._walk(points))
+        return self.grid
+
+    def save(self, path, scaler):
+        arrays = dict(feature=self.feature, threshold=self.threshold, left=self.left,
+                      right=self.right, value=self.value, roots=self.roots,
+                      max_depth=np.array(self.max_depth),
+                      scale=scaler.scale, offset=scaler.offset)
+        np.savez(path, **arrays)
+
+
+def load_compiled(path=COMPILED_MODEL_FILE, grid=True):
+    # (forest, scaler) from an exported artifact
+    with np.load(path) as data:
+        forest = CompiledForest(data['feature'], data['threshold'], data['left'], data['right'],
+                                data['value'], data['roots'], data['max_depth'])
+        scaler = CompiledScaler(data['scale'], data['offset'])
+    if grid:
+        forest.build_grid(len(scaler.scale))
+    return forest, scaler
+
+
+def arrays_dir(path):
+    # Where unpack() puts an artifact's .npy files: beside it, named by its
+    # contents, so a re-exported artifact never reuses stale arrays
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:12]
+    return f"{os.path.splitext(path)[0]}.{digest}.arrays"
+
+
+def unpack(path):
+    # Write an artifact's arrays and its lookup grid as one .npy file each
+    # and return the directory. An .npz is a zip and can't be mapped; these
+    # can. Built under a temporary name and renamed into place, so a reader
+    # never sees a partial set.
+    directory = arrays_dir(path)
+    if os.path.isdir(directory):
+        return directory
+    forest, scaler = load_compiled(path)
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in ARRAY_NAMES}
+    if forest.grid is not None:
+        edges, cells = forest.grid
+        arrays.update({f'grid_edges_{f}': feature_edges for f, feature_edges in enumerate(edges)})
+        arrays['grid_cells'] = cells
+
+    temporary = f"{directory}.{os.getpid()}.tmp"
+    os.makedirs(temporary, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(temporary, f'{name}.npy'), array)
+    try:
+        os.rename(temporary, directory)
+    except OSError:
+        shutil.rmtree(temporary)  # another process unpacked it first
+    return directory
+
+
+# (forest, scaler) per unpacked directory, so a process maps each one once
+_mapped = {}
+
+
+def load_mapped(directory):
+    # (forest, scaler) over read-only memory maps of unpack()'s files. Pages
+    # come from the page cache, so every process serving the same artifact
+    # shares one copy, and the lookup grid isn't rebuilt per process.
+    if directory not in _mapped:
+        def array(name):
+            return np.asarray(np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+
+        forest = CompiledForest(array('feature'), array('threshold'), array('left'), array('right'),
+                                array('value'), array('roots'), array('max_depth'))
+        scaler = CompiledScaler(array('scale'), array('offset'))
+        if os.path.exists(os.path.join(directory, 'grid_cells.npy')):
+            forest.grid = ([array(f'grid_edges_{f}') for f in range(len(scaler.scale))], array('grid_cells'))
+        _mapped[directory] = (forest, scaler)
+    return _mapped[directory]
+
+
+def compile_forest(model):
+    # Flatten a fitted sklearn RandomForestRegressor (single output)
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        node_ids = np.arange(tree.node_count)
+        is_leaf = tree.children_left == -1
+
+        roots.append(offset)
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+        lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+        rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+        values.append(tree.value[:, 0, 0])
+        max_depth = max(max_depth, tree.max_depth)
+        offset += tree.node_count
+
+    index_type = np.int32 if offset < 2 ** 31 else np.int64
+    return CompiledForest(np.concatenate(features).astype(np.int8 if model.n_features_in_ < 128 else np.int32),
+                          np.concatenate(thresholds).astype(np.float64),
+                          np.concatenate(lefts).astype(index_type),
+                          np.concatenate(rights).astype(index_type),
+                          np.concatenate(values).astype(np.float64),
+                          np.array(roots, dtype=index_type),
+                          max_depth)
+
+
+def export_model(model, scaler, path=COMPILED_MODEL_FILE):
+    forest = compile_forest(model)
+    forest.save(path, CompiledScaler(scaler.scale_.astype(np.float64), scaler.min_.astype(np.float64)))
+    return forest
+
+
+def compare(model, scaler, path=COMPILED_MODEL_FILE, samples=100000, seed=42):
+    # Largest absolute difference between sklearn and the compiled artifact
+    # (tree walk and grid) on random features spanning the training range
+    from matching import FEATURES
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    low = -scaler.min_ / scaler.scale_
+    high = (1 - scaler.min_) / scaler.scale_
+    span = high - low
+    features = rng.uniform(low - span, high + span, size=(samples, len(FEATURES)))
+    features[:, 2] = np.round(features[:, 2])  # urgency_level is an integer
+
+    expected = model.predict(scaler.transform(pd.DataFrame(features, columns=FEATURES)))
+    forest, compiled_scaler = load_compiled(path)
+    scaled = compiled_scaler.transform(features)
+    return (np.max(np.abs(forest.predict_nodes(scaled) - expected)),
+            np.max(np.abs(forest.predict(scaled) - expected)) if forest.grid is not None else None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export the sklearn model to the compiled format")
+    parser.add_argument('--model', default='organ_matching_model.pkl')
+    parser.add_argument('--scaler', default='scaler.pkl')
+    parser.add_argument('--out', default=COMPILED_MODEL_FILE)
+    args = parser.parse_args()
+
+    import joblib
+    model = joblib.load(args.model)
+    scaler = joblib.load(args.scaler)
+    export_model(model, scaler, args.out)
+    walk_error, grid_error = compare(model, scaler, args.out)
+    print(f"Exported {args.out}")
+    print(f"Max abs difference from sklearn: {walk_error:.3g} (tree walk)")
+    if grid_error is not None:
+        print(f"Max abs difference from sklearn: {grid_error:.3g} (lookup grid)")
@@ -0,0 +1,88 @@
+import math
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Same radius as the haversine() match() used before
+
+# Columns holding the precomputed unit vector of each donor/recipient location
+GEO_COLUMNS = ('geo_x', 'geo_y', 'geo_z')
+
+
+def unit_vector(latitude, longitude):
+    # 3D point on the unit sphere, stored alongside latitude/longitude
+    phi = math.radians(latitude)
+    lam = math.radians(longitude)
+    return (math.cos(phi) * math.cos(lam),
+            math.cos(phi) * math.sin(lam),
+            math.sin(phi))
+
+
+def unit_vectors(latitudes, longitudes):
+    phi = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lam = np.radians(np.asarray(longitudes, dtype=np.float64))
+    cos_phi = np.cos(phi)
+    return np.column_stack((cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)))
+
+
+def distances_km(origin, vectors):
+    # Great-circle distance from one unit vector to N unit vectors. Uses the
+    # chord length rather than a dot product so short distances stay accurate.
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    chord = np.sqrt(np.sum((vectors - np.asarray(origin, dtype=np.float64)) ** 2, axis=1))
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.clip(chord / 2, 0, 1))
+
+
+def distance_matrix(origins, vectors):
+    # (M, N) great-circle distances between M and N unit vectors. The squared
+    # chord comes from one matrix product (|a - b|^2 = 2 - 2 a.b for unit
+    # vectors); rounding error stays within centimetres at any distance.
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    vectors = np.asarray(vectors, dtype=np.float64).reshape(-1, 3)
+    chord_squared = np.clip(2 - 2 * (origins @ vectors.T), 0, 4)
+    return EARTH_RADIUS_KM * 2 * np.arcsin(np.sqrt(chord_squared) / 2)
+
+
+def vectors_from_rows(rows, lat_index, lon_index, geo_index):
+    # Build an (N, 3) array from query rows, filling rows written before the
+    # geo columns existed from their latitude/longitude
+    vectors = np.array([row[geo_index:geo_index + 3] for row in rows], dtype=np.float64).reshape(-1, 3)
+    missing = np.isnan(vectors).any(axis=1)
+    if missing.any():
+        lats = [rows[i][lat_index] for i in np.flatnonzero(missing)]
+        lons = [rows[i][lon_index] for i in np.flatnonzero(missing)]
+        vectors[missing] = unit_vectors(lats, lons)
+    return vectors
+
+
+def bounding_box(latitude, longitude, radius_km):
+    # (min_lat, max_lat, min_lon, max_lon) enclosing every point within
+    # radius_km of the origin. Near the poles it widens to every longitude;
+    # across the antimeridian min_lon ends up greater than max_lon.
+    angular = radius_km / EARTH_RADIUS_KM
+    min_lat = latitude - math.degrees(angular)
+    max_lat = latitude + math.degrees(angular)
+
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+
+    delta_lon = math.degrees(math.asin(min(1, math.sin(angular) / math.cos(math.radians(latitude)))))
+    min_lon = longitude - delta_lon
+    max_lon = longitude + delta_lon
+    if min_lon < -180:
+        min_lon += 360
+    if max_lon > 180:
+        max_lon -= 360
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def rtree_clause(box, alias='r'):
+    # WHERE fragment and parameters selecting donors_rtree entries inside a
+    # (min_lat, max_lat, min_lon, max_lon) box. A box whose west edge is east
+    # of its east edge wraps across the antimeridian.
+    min_lat, max_lat, min_lon, max_lon = box
+    if min_lon <= max_lon:
+        clause = (f"{alias}.max_lat >= ? AND {alias}.min_lat <= ? "
+                  f"AND {alias}.max_lon >= ? AND {alias}.min_lon <= ?")
+    else:
+        clause = (f"{alias}.max_lat >= ? AND {alias}.min_lat <= ? "
+                  f"AND ({alias}.max_lon >= ? OR {alias}.min_lon <= ?)")
+    return clause, (min_lat, max_lat, min_lon, max_lon)
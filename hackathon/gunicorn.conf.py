@@ -0,0 +1,38 @@
+import os
+
+# Production real-time mode: several gunicorn instances, one cooperative
+# worker each, behind nginx with sticky sessions, sharing a message queue.
+#
+#   python serve.py --instances 4          # relay + instances on 8001-8004
+#   nginx -c $PWD/nginx.conf               # ip_hash over those ports
+#
+# or by hand, with Redis instead of the local relay:
+#
+#   SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 PORT=8001 gunicorn -c gunicorn.conf.py app:app
+#
+# One worker per instance because Socket.IO's long-polling transport needs
+# every request of a session to reach the same process: nginx's ip_hash
+# pins a client to an instance, but gunicorn balances its own workers
+# freely. Emits from any instance reach clients on the others through
+# SOCKETIO_MESSAGE_QUEUE.
+#
+# gevent is the default; SOCKETIO_ASYNC_MODE=eventlet also works with the
+# pinned gunicorn (later releases drop the eventlet worker).
+
+async_mode = os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'gevent')
+worker_class = {
+    'eventlet': 'eventlet',
+    'gevent': 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker',
+}[async_mode]
+workers = 1
+# Concurrent sockets per instance
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 4000))
+bind = f"{os.environ.get('HOST', '127.0.0.1')}:{os.environ.get('PORT', 8001)}"
+timeout = 60
+keepalive = 5
+
+# unix:// is the local relay's socket in a private directory (see
+# message_queue.runtime_dir); not imported here, so socketio loads after
+# the worker's monkey patching
+os.environ.setdefault('SOCKETIO_MESSAGE_QUEUE', 'unix://')
+os.environ.setdefault('WARMUP', '1')
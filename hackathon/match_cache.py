@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MatchCache:
+    # Bounded LRU of scored candidate lists per recipient, with a TTL.
+    #
+    # Each entry remembers the max_distance it was scored for, so a list
+    # scored for 500 km also answers a 200 km request, and a full list (inf)
+    # answers everything. Entries hold scores only; request statuses are
+    # merged in per request, so request changes never make an entry stale.
+    # The cache is per process: with several workers, the TTL bounds how long
+    # another worker can serve a list that was invalidated elsewhere.
+    def __init__(self, maxsize=512, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, recipient_id, max_distance=float('inf')):
+        with self._lock:
+            entry = self._entries.get(recipient_id)
+            if entry is not None:
+                organ, radius, candidates, stored_at = entry
+                if time.monotonic() - stored_at > self.ttl:
+                    del self._entries[recipient_id]
+                    entry = None
+                elif radius < max_distance:
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(recipient_id)
+            self.hits += 1
+            return candidates
+
+    def put(self, recipient_id, organ, candidates, max_distance=float('inf')):
+        with self._lock:
+            self._entries[recipient_id] = (organ, max_distance, candidates, time.monotonic())
+            self._entries.move_to_end(recipient_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate_recipient(self, recipient_id):
+        with self._lock:
+            if self._entries.pop(recipient_id, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_organ(self, organ):
+        # A donor for this organ was added or removed: every recipient
+        # needing it may now have a different candidate list
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry[0] == organ]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,41 @@
+import time
+import numpy as np
+import metrics
+
+# Feature columns the scaler and model were trained on (see model.py)
+FEATURES = ['age_similarity', 'distance_score', 'urgency_level']
+
+
+def build_features(recipient_age, urgency_level, donor_ages, distances):
+    # One row per donor/recipient pair, same formulas as model.py. Any
+    # argument may be a scalar or an array with one entry per pair.
+    distances = np.asarray(distances, dtype=np.float64)
+    donor_ages = np.asarray(donor_ages, dtype=np.float64)
+    recipient_age = np.asarray(recipient_age, dtype=np.float64)
+
+    features = np.empty((len(distances), len(FEATURES)), dtype=np.float64)
+    features[:, 0] = 1 / (1 + np.abs(donor_ages - recipient_age))
+    features[:, 1] = 1 / (1 + distances)
+    features[:, 2] = urgency_level
+    return features
+
+
+def score_features(model, scaler, features):
+    # Scale and predict the whole candidate set in a single call each
+    if len(features) == 0:
+        return np.empty(0, dtype=np.float64)
+
+    if hasattr(scaler, 'feature_names_in_'):
+        # An sklearn scaler fitted on a DataFrame expects the same columns
+        import pandas as pd
+        features = pd.DataFrame(features, columns=FEATURES)
+    if not metrics.ENABLED:
+        return model.predict(scaler.transform(features))
+
+    start = time.perf_counter()
+    input_data_scaled = scaler.transform(features)
+    scaled_at = time.perf_counter()
+    predictions = model.predict(input_data_scaled)
+    metrics.record_model('transform', scaled_at - start, len(features))
+    metrics.record_model('predict', time.perf_counter() - scaled_at, len(features))
+    return predictions
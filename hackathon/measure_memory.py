@@ -0,0 +1,99 @@
+import argparse
+import subprocess
+import sys
+
+# Per-process memory of the model under two loading strategies, or of
+# running processes (Linux only: reads /proc/<pid>/smaps_rollup).
+#
+#   python measure_memory.py --processes 4
+#   python measure_memory.py --pids $(pgrep -f 'gunicorn')
+#
+# Each mode starts --processes independent interpreters, like the one-worker
+# gunicorn instances serve.py starts, and measures them while all are alive:
+#   private    every process reads the .npz and builds its own lookup grid
+#              (how the app loaded the model before memory mapping)
+#   mapped     every process maps the unpacked .npy files (registry.load)
+#
+# RSS counts shared pages in full for every process; PSS splits them between
+# the processes sharing them; USS is what the process alone holds.
+
+MODES = ('private', 'mapped')
+
+
+def memory(pid='self'):
+    # {'rss', 'pss', 'uss'} in KiB
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss': values['Rss'], 'pss': values['Pss'],
+            'uss': values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)}
+
+
+def serve_model(mode, size=100000):
+    # A stand-in worker: load the model, score one large batch the way
+    # serving does, then wait until the parent has measured it
+    import numpy as np
+    import registry
+    from forest import load_compiled
+    from matching import build_features, score_features
+    if mode == 'private':
+        model, scaler = load_compiled(registry.artifact_path())
+    else:
+        model, scaler, _ = registry.load()
+    rng = np.random.default_rng(0)
+    features = build_features(rng.integers(1, 80, size), rng.integers(1, 5, size), rng.integers(18, 80, size),
+                              rng.uniform(0, 3000, size))
+    score_features(model, scaler, features)
+    print('ready', flush=True)
+    sys.stdin.read()
+
+
+def run_mode(mode, count):
+    # Memory of count simultaneous stand-in workers (PSS depends on who else
+    # shares a page, so every one is measured while all are running)
+    processes = [subprocess.Popen([sys.executable, __file__, '--serve', mode], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, text=True)
+                 for _ in range(count)]
+    try:
+        for process in processes:
+            if process.stdout.readline().strip() != 'ready':
+                raise RuntimeError(f"{mode} worker failed to start")
+        return [memory(process.pid) for process in processes]
+    finally:
+        for process in processes:
+            process.stdin.close()
+            process.wait()
+
+
+def summarize(results):
+    return {key: sum(result[key] for result in results) / len(results) for key in ('rss', 'pss', 'uss')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Report per-process RSS/PSS/USS of model loading strategies")
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--pids', nargs='+', type=int, help="measure these running processes instead")
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_model(args.serve)
+    elif args.pids:
+        print(f"{'pid':>8} {'RSS KiB':>10} {'PSS KiB':>10} {'USS KiB':>10}")
+        for pid in args.pids:
+            usage = memory(pid)
+            print(f"{pid:>8} {usage['rss']:>10} {usage['pss']:>10} {usage['uss']:>10}")
+    else:
+        # Unpack once up front so no mode pays for it
+        import registry
+        from forest import unpack
+        unpack(registry.artifact_path())
+        print(f"{args.processes} processes, mean per process:")
+        print(f"{'mode':<10} {'RSS KiB':>10} {'PSS KiB':>10} {'USS KiB':>10}")
+        for mode in args.modes:
+            usage = summarize(run_mode(mode, args.processes))
+            print(f"{mode:<10} {usage['rss']:>10.0f} {usage['pss']:>10.0f} {usage['uss']:>10.0f}")
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import stat
+import struct
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+from socketio import PubSubManager
+
+# Socket.IO message queue over a UNIX socket: a stand-in for Redis/AMQP when
+# every worker runs on one machine, and for tests. serve() relays each frame
+# it receives to every connected worker; UnixSocketManager is the
+# python-socketio client manager that talks to it.
+#
+#   python message_queue.py
+#   SOCKETIO_MESSAGE_QUEUE=unix:// gunicorn -c gunicorn.conf.py app:app
+#
+# Frames are JSON (PubSubManager's messages are plain dicts). Whoever can
+# connect to the socket can emit to every client, so it lives in a directory
+# only this user can enter: unix:// with no path means mq.sock in
+# runtime_dir(), and both ends refuse a directory that isn't private.
+
+DEFAULT_URL = 'unix://'
+
+HEADER = struct.Struct('>I')  # frame length
+
+# Frames the relay holds for one worker before it treats the worker as stuck
+# and disconnects it (the worker reconnects, see UnixSocketManager._listen)
+MAX_PENDING_FRAMES = 10000
+
+
+def runtime_dir():
+    # $XDG_RUNTIME_DIR/lifelink when the session has one, else a per-user
+    # directory in the temp dir
+    base = os.environ.get('XDG_RUNTIME_DIR')
+    if base:
+        return os.path.join(base, 'lifelink')
+    return os.path.join(tempfile.gettempdir(), f'lifelink-{os.getuid()}')
+
+
+def socket_path(url):
+    return urlparse(url).path or os.path.join(runtime_dir(), 'mq.sock')
+
+
+def check_private_dir(path):
+    # Create the socket's directory with mode 0700, or make sure an existing
+    # one is a real directory owned by this user that nobody else can enter
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"Refusing message queue socket {path}: {directory} must be a directory "
+                           f"owned by uid {os.getuid()} with mode 0700")
+
+
+def send_frame(sock, data):
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("message queue connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return recv_exactly(sock, size)
+
+
+class UnixSocketManager(PubSubManager):
+    # Publishes and listens through the relay started by serve(). Messages
+    # published while the relay is unreachable are dropped, as they would be
+    # by the other backends when their broker is down.
+    name = 'unix'
+
+    def __init__(self, url=DEFAULT_URL, channel='socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.path = socket_path(url)
+        check_private_dir(self.path)
+        self._publisher = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+
+    def _publish(self, data):
+        try:
+            frame = json.dumps(data).encode()
+        except (TypeError, ValueError) as e:
+            print(f"Message queue publish skipped, payload is not JSON: {e}")
+            return
+        with self._lock:
+            # A connection must not cross a fork
+            if self._pid != os.getpid():
+                self._publisher, self._pid = None, os.getpid()
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect()
+                    send_frame(self._publisher, frame)
+                    return
+                except OSError as e:
+                    self._publisher = None
+                    if attempt:
+                        print(f"Message queue publish failed: {e}")
+
+    def _listen(self):
+        retry_delay = 1
+        while True:
+            sock = None
+            try:
+                sock = self._connect()
+                retry_delay = 1
+                while True:
+                    # Decoded here: PubSubManager would unpickle raw bytes
+                    yield json.loads(recv_frame(sock))
+            except (OSError, ConnectionError, ValueError) as e:
+                # A frame that doesn't decode means the stream is out of
+                # step; a fresh connection starts again on a frame boundary
+                if sock is not None:
+                    sock.close()
+                print(f"Message queue connection lost ({e}), retrying in {retry_delay}s")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, 30)
+
+
+class Relay:
+    # Fan-out hub: every frame from one worker goes to all of them, the
+    # sender included (PubSubManager skips its own messages by host_id).
+    # Each worker has a reader thread and a writer thread draining its own
+    # queue, so frames to one socket are never interleaved and a slow reader
+    # only holds up itself.
+    def __init__(self, path):
+        self.path = path
+        self._clients = {}  # socket -> queue of frames for its writer
+        self._lock = threading.Lock()
+        check_private_dir(path)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(path)
+        self._server.listen(128)
+
+    def serve_forever(self):
+        while True:
+            try:
+                client, _ = self._server.accept()
+            except OSError:
+                return  # closed
+            frames = queue.Queue()
+            with self._lock:
+                self._clients[client] = frames
+            threading.Thread(target=self._relay, args=(client,), daemon=True).start()
+            threading.Thread(target=self._write, args=(client, frames), daemon=True).start()
+
+    def _relay(self, client):
+        try:
+            while True:
+                frame = recv_frame(client)
+                with self._lock:
+                    clients = list(self._clients.items())
+                for other, frames in clients:
+                    if frames.qsize() >= MAX_PENDING_FRAMES:
+                        print(f"Message queue client fell {MAX_PENDING_FRAMES} frames behind, disconnecting it")
+                        self._drop(other)
+                    else:
+                        frames.put(frame)
+        except (OSError, ConnectionError):
+            self._drop(client)
+
+    def _write(self, client, frames):
+        # The only thread that writes to or closes this client's socket
+        try:
+            while True:
+                frame = frames.get()
+                if frame is None:
+                    break
+                send_frame(client, frame)
+        except OSError:
+            self._drop(client)
+        client.close()
+
+    def _drop(self, client):
+        # Stop relaying to a client: wake its reader with a shutdown and let
+        # its writer close the socket
+        with self._lock:
+            frames = self._clients.pop(client, None)
+        if frames is None:
+            return
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        frames.put(None)
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            self._drop(client)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(url=DEFAULT_URL):
+    Relay(socket_path(url)).serve_forever()
+
+
+def start_relay(url=DEFAULT_URL):
+    # Run the relay on a thread of the current process (tests, single-host
+    # launchers). Returns the Relay; call close() to stop it.
+    relay = Relay(socket_path(url))
+    threading.Thread(target=relay.serve_forever, name='message-queue', daemon=True).start()
+    return relay
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the UNIX socket Socket.IO message queue")
+    parser.add_argument('path', nargs='?', default=socket_path(DEFAULT_URL), help="socket file")
+    args = parser.parse_args()
+    print(f"Relaying Socket.IO messages on {args.path}")
+    serve(f"unix://{args.path}")
@@ -0,0 +1,185 @@
+import bisect
+import os
+import sqlite3
+import threading
+import time
+
+# Prometheus text-format metrics for the Flask app, served at /metrics.
+# Off unless METRICS is set: install() is then never called, connections are
+# plain sqlite3 ones and the only cost left is an `if metrics.ENABLED` test
+# per Socket.IO emit and per scoring call.
+
+ENABLED = bool(os.environ.get('METRICS'))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000)
+
+
+def format_labels(names, values):
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}  # labels -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    bucket_labels = format_labels(self.labelnames + ('le',), labels + (bound,))
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', "Flask request latency",
+                            ('endpoint', 'method', 'status'))
+SQL_STATEMENTS = Counter('sql_statements_total', "SQL statements executed", ('endpoint',))
+SQL_SECONDS = Counter('sql_seconds_total', "Time spent executing SQL statements", ('endpoint',))
+SQL_STATEMENTS_PER_REQUEST = Histogram('sql_statements_per_request', "SQL statements per request",
+                                       ('endpoint',), COUNT_BUCKETS)
+SQL_SECONDS_PER_REQUEST = Histogram('sql_seconds_per_request', "SQL execution time per request", ('endpoint',))
+MODEL_SECONDS = Histogram('model_seconds', "scaler.transform / model.predict time per call", ('stage',))
+MODEL_BATCH_SIZE = Histogram('model_batch_size', "Rows per scaler.transform / model.predict call",
+                             ('stage',), COUNT_BUCKETS)
+SOCKETIO_EMITS = Counter('socketio_emits_total', "Socket.IO events emitted, by event and room kind",
+                         ('event', 'room'))
+
+REGISTRY = [REQUEST_SECONDS, SQL_STATEMENTS, SQL_SECONDS, SQL_STATEMENTS_PER_REQUEST, SQL_SECONDS_PER_REQUEST,
+            MODEL_SECONDS, MODEL_BATCH_SIZE, SOCKETIO_EMITS]
+
+# SQL totals for the request being handled on this thread (greenlet under
+# gevent/eventlet): [endpoint, statements, seconds]
+_current = threading.local()
+
+
+def record_sql(seconds):
+    current = getattr(_current, 'request', None)
+    endpoint = current[0] if current else 'background'
+    SQL_STATEMENTS.inc(endpoint)
+    SQL_SECONDS.inc(endpoint, amount=seconds)
+    if current:
+        current[1] += 1
+        current[2] += seconds
+
+
+def record_model(stage, seconds, batch_size):
+    MODEL_SECONDS.observe(seconds, stage)
+    MODEL_BATCH_SIZE.observe(batch_size, stage)
+
+
+def record_emit(event, room):
+    # Rooms are per user, so they are counted by kind ('donor', 'recipient')
+    SOCKETIO_EMITS.inc(event, str(room).split(':', 1)[0])
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Times statement execution (the first step; rows fetched later are not
+    # included)
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_sql(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_sql(time.perf_counter() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection factory for ConnectionPool when metrics are on
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def install(app):
+    # Request hooks and the /metrics endpoint
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g._metrics_start = time.perf_counter()
+        _current.request = [request.endpoint or 'unmatched', 0, 0.0]
+
+    @app.after_request
+    def record_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request(exception):
+        start = g.pop('_metrics_start', None)
+        current = getattr(_current, 'request', None)
+        _current.request = None
+        if start is None or current is None:
+            return
+        endpoint, statements, seconds = current
+        status = g.pop('_metrics_status', 500)
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, request.method, status)
+        SQL_STATEMENTS_PER_REQUEST.observe(statements, endpoint)
+        SQL_SECONDS_PER_REQUEST.observe(seconds, endpoint)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
@@ -0,0 +1,535 @@
+import argparse
+import ast
+import sqlite3
+
+# SQLite database file name
+DB_FILE = 'organ_donation.db'
+
+
+def create_base_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email TEXT UNIQUE,
+            password TEXT,
+            user_type TEXT
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS donors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT,
+            email TEXT,
+            blood_type TEXT,
+            organ TEXT,
+            age INTEGER,
+            longitude REAL,
+            latitude REAL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recipients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT,
+            email TEXT,
+            blood_type TEXT,
+            needed_organ TEXT,
+            urgency_level INTEGER,
+            age INTEGER,
+            longitude REAL,
+            latitude REAL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            message TEXT,
+            type TEXT,
+            FOREIGN KEY (user_id) REFERENCES recipients(id)
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            donor_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            status TEXT DEFAULT 'pending',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (donor_id) REFERENCES donors(id),
+            FOREIGN KEY (recipient_id) REFERENCES recipients(id)
+        )
+    ''')
+
+    # Registrations waiting for admin approval, same structure as donors/recipients
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pre_donors (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT,
+            email TEXT,
+            blood_type TEXT,
+            organ TEXT,
+            age INTEGER,
+            longitude REAL,
+            latitude REAL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pre_recipients (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            full_name TEXT,
+            email TEXT,
+            blood_type TEXT,
+            needed_organ TEXT,
+            urgency_level INTEGER,
+            age INTEGER,
+            longitude REAL,
+            latitude REAL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            donor_id INTEGER,
+            recipient_id INTEGER,
+            match_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            donor_name TEXT,
+            recipient_name TEXT,
+            organ TEXT,
+            FOREIGN KEY (donor_id) REFERENCES donors (id),
+            FOREIGN KEY (recipient_id) REFERENCES recipients (id)
+        )
+    ''')
+
+
+def add_geo_columns(cursor):
+    # Precomputed unit vector of each donor/recipient location, backfilled for
+    # rows that were approved before the columns existed
+    from geo import GEO_COLUMNS, unit_vector
+
+    for table in ('donors', 'recipients'):
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for column in GEO_COLUMNS:
+            if column not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} REAL")
+
+        cursor.execute(f'''
+            SELECT id, latitude, longitude FROM {table}
+            WHERE geo_x IS NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+        ''')
+        cursor.executemany(
+            f"UPDATE {table} SET geo_x = ?, geo_y = ?, geo_z = ? WHERE id = ?",
+            [unit_vector(latitude, longitude) + (row_id,)
+             for row_id, latitude, longitude in cursor.fetchall()]
+        )
+
+
+def add_spatial_index(cursor):
+    # R*Tree over donor locations. Triggers keep it in step with the donors
+    # table, so approve_donor and delete_user maintain it without extra code.
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS donors_rtree
+        USING rtree(id, min_lat, max_lat, min_lon, max_lon)
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS donors_rtree_insert AFTER INSERT ON donors
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            INSERT OR REPLACE INTO donors_rtree
+            VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS donors_rtree_update AFTER UPDATE OF latitude, longitude ON donors
+        BEGIN
+            DELETE FROM donors_rtree WHERE id = OLD.id;
+            INSERT INTO donors_rtree
+            SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+            WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS donors_rtree_delete AFTER DELETE ON donors
+        BEGIN
+            DELETE FROM donors_rtree WHERE id = OLD.id;
+        END
+    ''')
+
+    # Index donors that were approved before the R*Tree existed
+    cursor.execute('''
+        INSERT OR REPLACE INTO donors_rtree
+        SELECT id, latitude, latitude, longitude, longitude FROM donors
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    ''')
+
+
+def add_query_indexes(cursor):
+    # Candidate lookups in match() and map_matches()
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_donors_organ ON donors (organ)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recipients_needed_organ ON recipients (needed_organ)")
+
+    # Latest-status lookup in match(), answered from the index alone (id is the rowid)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_requests_recipient_donor
+        ON requests (recipient_id, donor_id, status)
+    ''')
+    # /requests/<donor_id>, send_request and /accepted_requests/<recipient_id>
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_donor_status ON requests (donor_id, status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_requests_recipient_status ON requests (recipient_id, status)")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id)")
+
+    # Email lookups in login and delete_user
+    for table in ('donors', 'recipients', 'pre_donors', 'pre_recipients'):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_email ON {table} (email)")
+
+    # Admin panel lists matches newest first
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_matches_match_date ON matches (match_date)")
+
+
+def add_compatibility_scores(cursor):
+    # Model scores per donor/recipient pair, maintained as donors and
+    # recipients are approved (see scores.py). Rows for deleted donors and
+    # recipients are removed by the triggers below.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS compatibility_scores (
+            donor_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            distance_km REAL,
+            score REAL,
+            model_version TEXT,
+            PRIMARY KEY (recipient_id, donor_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Ranked read in match()
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_compatibility_scores_ranked
+        ON compatibility_scores (recipient_id, score DESC)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_compatibility_scores_donor
+        ON compatibility_scores (donor_id)
+    ''')
+
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS compatibility_scores_donor_delete AFTER DELETE ON donors
+        BEGIN
+            DELETE FROM compatibility_scores WHERE donor_id = OLD.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS compatibility_scores_recipient_delete AFTER DELETE ON recipients
+        BEGIN
+            DELETE FROM compatibility_scores WHERE recipient_id = OLD.id;
+        END
+    ''')
+
+
+def add_notification_events(cursor):
+    # Notifications stored once per event. Topic events (e.g. a new donor for
+    # 'organ:Kidney') are resolved per recipient at read time; events with a
+    # user_id are addressed to that one user.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT,
+            user_id INTEGER,
+            message TEXT,
+            type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notification_events_topic ON notification_events (topic, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notification_events_user ON notification_events (user_id, id)")
+
+    # Per-user read position. subscribed_from hides topic events published
+    # before the user was subscribed, as the per-recipient rows used to.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS notification_cursors (
+            user_id INTEGER PRIMARY KEY,
+            subscribed_from INTEGER NOT NULL DEFAULT 0,
+            last_read_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+    # Existing per-recipient rows carry over as user-addressed events
+    cursor.execute('''
+        INSERT INTO notification_events (user_id, message, type)
+        SELECT user_id, message, type FROM notifications ORDER BY id
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO notification_cursors (user_id, subscribed_from)
+        SELECT id, (SELECT COALESCE(MAX(id), 0) FROM notification_events) FROM recipients
+    ''')
+
+
+def add_socket_events(cursor):
+    # Recent Socket.IO events per room, shared by every worker process so a
+    # client can rejoin on any of them and be replayed what it missed
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS socket_events (
+            room TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            PRIMARY KEY (room, seq)
+        ) WITHOUT ROWID
+    ''')
+
+
+def add_outbox(cursor):
+    # Socket events written in the same transaction as the change they
+    # announce, drained after commit (see outbox.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room TEXT NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            coalesce_key TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+
+def add_admin_indexes(cursor):
+    # Filtered keyset pages of the admin panel: each filter column paired
+    # with id, so a filtered page is a single index range read
+    for name, table, columns in (
+        ('idx_pre_donors_blood_type', 'pre_donors', 'blood_type, id'),
+        ('idx_pre_donors_organ', 'pre_donors', 'organ, id'),
+        ('idx_pre_recipients_blood_type', 'pre_recipients', 'blood_type, id'),
+        ('idx_pre_recipients_needed_organ', 'pre_recipients', 'needed_organ, id'),
+        ('idx_pre_recipients_urgency', 'pre_recipients', 'urgency_level, id'),
+        ('idx_users_user_type', 'users', 'user_type, id'),
+        ('idx_matches_organ', 'matches', 'organ, id'),
+    ):
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def add_allocations(cursor):
+    # Global allocation runs and the donor proposed for each recipient (see
+    # allocation.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS allocation_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            organ TEXT NOT NULL,
+            status TEXT NOT NULL,
+            parameters TEXT,
+            donors INTEGER,
+            recipients INTEGER,
+            candidate_pairs INTEGER,
+            assigned INTEGER,
+            total_weight REAL,
+            seconds REAL,
+            model_version TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS allocation_proposals (
+            run_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            donor_id INTEGER NOT NULL,
+            distance_km REAL,
+            score REAL,
+            weight REAL,
+            PRIMARY KEY (run_id, recipient_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def add_blood_type_indexes(cursor):
+    # Candidate queries select an organ's donors/recipients of the compatible
+    # blood types (see blood.py): one index range per type
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_donors_organ_blood_type ON donors (organ, blood_type)")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipients_needed_organ_blood_type
+        ON recipients (needed_organ, blood_type)
+    ''')
+
+
+def add_scored_recipients(cursor):
+    # Recipients whose candidates have all been scored, and by which model
+    # version (see scores.mark_scored). A recipient with no compatible donor
+    # has no compatibility_scores rows, so their absence can't say that.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scored_recipients (
+            recipient_id INTEGER PRIMARY KEY,
+            model_version TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS scored_recipients_recipient_delete AFTER DELETE ON recipients
+        BEGIN
+            DELETE FROM scored_recipients WHERE recipient_id = OLD.id;
+        END
+    ''')
+    # Recipients already scored by a single model version
+    cursor.execute('''
+        INSERT OR IGNORE INTO scored_recipients (recipient_id, model_version)
+        SELECT recipient_id, MIN(model_version) FROM compatibility_scores
+        GROUP BY recipient_id
+        HAVING COUNT(DISTINCT model_version) = 1 AND MIN(model_version) IS NOT NULL
+    ''')
+
+
+# Numbered migrations, applied in order. Never renumber or edit one that has
+# shipped; append a new one instead. Each must be safe to run against a
+# database that already has some of its objects.
+MIGRATIONS = [
+    (1, 'base tables', create_base_tables),
+    (2, 'donor/recipient unit vectors', add_geo_columns),
+    (3, 'donor location R*Tree', add_spatial_index),
+    (4, 'indexes for hot queries', add_query_indexes),
+    (5, 'compatibility scores', add_compatibility_scores),
+    (6, 'fan-out-on-read notifications', add_notification_events),
+    (7, 'shared Socket.IO event log', add_socket_events),
+    (8, 'socket event outbox', add_outbox),
+    (9, 'admin panel filter indexes', add_admin_indexes),
+    (10, 'global allocation runs', add_allocations),
+    (11, 'blood type candidate indexes', add_blood_type_indexes),
+    (12, 'scored recipient markers', add_scored_recipients),
+]
+
+
+def current_version(cursor):
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+
+def apply_migrations(connection):
+    # Each migration runs in its own transaction. BEGIN IMMEDIATE takes the
+    # write lock before the version check so concurrent workers starting up
+    # don't apply the same migration twice.
+    connection.isolation_level = None
+    cursor = connection.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    applied = []
+    for version, name, migration in MIGRATIONS:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= current_version(cursor):
+                cursor.execute("COMMIT")
+                continue
+            migration(cursor)
+            cursor.execute("INSERT INTO schema_version (version, name) VALUES (?, ?)", (version, name))
+            cursor.execute("COMMIT")
+            applied.append(version)
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+
+    cursor.close()
+    connection.isolation_level = ''
+    return applied
+
+
+def migrate(db_file=DB_FILE):
+    connection = sqlite3.connect(db_file)
+    try:
+        return apply_migrations(connection)
+    finally:
+        connection.close()
+
+
+def sql_statements(source_file):
+    # (line, sql) for every string literal in source_file that is a
+    # SELECT/INSERT/UPDATE/DELETE statement, plus the lines of f-string SQL
+    # that can't be planned without running the code
+    with open(source_file) as f:
+        tree = ast.parse(f.read())
+
+    # The literal pieces of an f-string are Constant nodes too; they are only
+    # fragments of the statement, listed as dynamic with their f-string
+    fragments = {id(part) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for part in node.values}
+
+    statements, dynamic = [], []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fragments:
+            sql = ' '.join(node.value.split())
+            if sql.upper().startswith(('SELECT ', 'INSERT ', 'UPDATE ', 'DELETE ', 'WITH ')):
+                statements.append((node.lineno, sql))
+        elif isinstance(node, ast.JoinedStr):
+            text = ''.join(part.value for part in node.values if isinstance(part, ast.Constant))
+            if text.split() and text.split()[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+                dynamic.append(node.lineno)
+    return sorted(statements), sorted(dynamic)
+
+
+def full_scan(detail, sql=''):
+    # A plan step reading a whole table or index: any SCAN step, including
+    # SCAN t USING INDEX i. Not a FROM-less SELECT (SCAN CONSTANT ROW, e.g.
+    # an EXISTS probe) or a virtual table such as json_each over a bound
+    # argument, and not a covering-index scan the statement's LIMIT bounds.
+    words = detail.split()
+    if len(words) < 2 or words[0] != 'SCAN' or words[1:] == ['CONSTANT', 'ROW']:
+        return False
+    if words[2:4] == ['VIRTUAL', 'TABLE']:
+        return False
+    if words[2:5] == ['USING', 'COVERING', 'INDEX'] and 'LIMIT' in sql.upper().split():
+        return False
+    return True
+
+
+def explain(source_file='app.py', db_file=':memory:'):
+    # Print EXPLAIN QUERY PLAN for every SQL statement in source_file against
+    # a migrated schema and return the number of statements doing a full scan
+    connection = sqlite3.connect(db_file)
+    apply_migrations(connection)
+    cursor = connection.cursor()
+
+    statements, dynamic = sql_statements(source_file)
+    scans = 0
+    for lineno, sql in statements:
+        print(f"{source_file}:{lineno}: {sql}")
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", (None,) * sql.count('?'))
+        except sqlite3.Error as e:
+            print(f"    error: {e}")
+            continue
+        for row in cursor.fetchall():
+            detail = row[-1]
+            scans += full_scan(detail, sql)
+            print(f"    {detail}{'   <-- full scan' if full_scan(detail, sql) else ''}")
+        print()
+
+    for lineno in dynamic:
+        print(f"{source_file}:{lineno}: dynamic SQL (f-string), not planned")
+
+    print(f"{len(statements)} statements planned, {scans} full scans")
+    connection.close()
+    return scans
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument('--db', default=DB_FILE, help="database file to migrate")
+    parser.add_argument('--explain', nargs='?', const='app.py', metavar='SOURCE',
+                        help="print EXPLAIN QUERY PLAN for every SQL statement in SOURCE "
+                             "(default app.py) against a freshly migrated in-memory schema")
+    args = parser.parse_args()
+
+    if args.explain:
+        explain(args.explain)
+    else:
+        applied = migrate(args.db)
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date.")
@@ -27,3 +27,12 @@ model.fit(X_train, y_train)
 # Save the model and scaler
 joblib.dump(model, 'organ_matching_model.pkl')
 joblib.dump(scaler, 'scaler.pkl')
+
+# Export the flattened copy and add it to the model registry. Serving
+# workers switch to it once it is activated (python registry.py activate
+# <version>, or POST /admin/model/reload), without restarting.
+from forest import export_model
+from registry import register
+export_model(model, scaler)
+version = register('organ_matching_model.npz', note='model.py')
+print(f"Registered model version {version}")
@@ -0,0 +1,151 @@
+import json
+import threading
+
+# Socket events are written to the outbox table inside the transaction that
+# makes the change, and sent by OutboxDispatcher once it has committed. A
+# rolled-back change never notifies anyone, and delivery never holds the
+# database write lock.
+
+BATCH_SIZE = 200
+
+# Backoff before retrying rows a drain couldn't deliver, in seconds
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+
+def enqueue(cursor, room, event, payload, key=None):
+    # Part of the caller's transaction. Events of the same name and key for
+    # the same room are coalesced when dispatched in one batch: only the last
+    # is sent.
+    cursor.execute("INSERT INTO outbox (room, event, payload, coalesce_key) VALUES (?, ?, ?, ?)",
+                   (room, event, json.dumps(payload), key))
+
+
+def coalesce(rows):
+    # Keep the newest row per (room, event, key), in id order; unkeyed rows
+    # all stay. A new_request and a request_update sharing a key are both sent.
+    latest = {}
+    for row in rows:
+        if row[4] is not None:
+            latest[(row[1], row[2], row[4])] = row[0]
+    return [row for row in rows if row[4] is None or latest[(row[1], row[2], row[4])] == row[0]]
+
+
+class OutboxDispatcher:
+    # Drains the outbox on a TaskQueue. wake() after each commit schedules a
+    # drain unless one is already pending, so a burst of commits is sent as a
+    # few batches. Rows are claimed with DELETE ... RETURNING, so several
+    # worker processes can drain the same outbox without sending twice.
+    #
+    # Rows that can't be sent are put back and retried on a timer, backing
+    # off from retry_delay to max_retry_delay, so they go out even if no
+    # later commit wakes the dispatcher. start() drains once on startup for
+    # rows a crashed or restarted worker never sent.
+    def __init__(self, pool, send, tasks, batch_size=BATCH_SIZE, retry_delay=RETRY_DELAY,
+                 max_retry_delay=MAX_RETRY_DELAY):
+        self.pool = pool
+        self.send = send  # send(room, event, payload)
+        self.tasks = tasks
+        self.batch_size = batch_size
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._lock = threading.Lock()
+        self._scheduled = False
+        self._retry_timer = None
+        self._next_delay = retry_delay
+        self._stats = {'batches': 0, 'claimed': 0, 'sent': 0, 'coalesced': 0, 'failed': 0, 'retries': 0}
+
+    def start(self):
+        self.wake()
+
+    def wake(self):
+        with self._lock:
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.tasks.submit('drain_outbox', self.drain)
+
+    def claim(self):
+        with self.pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY id LIMIT ?)
+                RETURNING id, room, event, payload, coalesce_key
+            """, (self.batch_size,))
+            rows = sorted(tuple(row) for row in cursor.fetchall())
+            connection.commit()
+        return rows
+
+    def drain(self):
+        with self._lock:
+            self._scheduled = False
+        try:
+            delivered = self.drain_batches()
+        except Exception as e:
+            print(f"Outbox drain failed: {e}")
+            delivered = False
+        if delivered:
+            with self._lock:
+                self._next_delay = self.retry_delay
+        else:
+            self.retry_later()
+
+    def drain_batches(self):
+        # True once the outbox is empty, False when a send failed
+        while True:
+            rows = self.claim()
+            if not rows:
+                return True
+            batch = coalesce(rows)
+            sent = 0
+            try:
+                for _, room, event, payload, _ in batch:
+                    self.send(room, event, json.loads(payload))
+                    sent += 1
+            except Exception as e:
+                # Put back what wasn't sent for the retry to pick up
+                print(f"Outbox dispatch failed: {e}")
+                self.restore(batch[sent:])
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['claimed'] += len(rows)
+                self._stats['sent'] += sent
+                self._stats['coalesced'] += len(rows) - len(batch)
+                self._stats['failed'] += len(batch) - sent
+            if sent < len(batch):
+                return False
+            if len(rows) < self.batch_size:
+                return True
+
+    def retry_later(self):
+        # One pending retry at a time; each one waits twice as long as the
+        # last, until a drain delivers everything
+        with self._lock:
+            if self._retry_timer is not None:
+                return
+            delay = self._next_delay
+            self._next_delay = min(delay * 2, self.max_retry_delay)
+            self._retry_timer = threading.Timer(delay, self.retry)
+            self._retry_timer.daemon = True
+            self._retry_timer.start()
+
+    def retry(self):
+        with self._lock:
+            self._retry_timer = None
+            self._stats['retries'] += 1
+        self.wake()
+
+    def restore(self, rows):
+        with self.pool.connection() as connection:
+            connection.executemany("""
+                INSERT INTO outbox (id, room, event, payload, coalesce_key) VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            connection.commit()
+
+    def stats(self):
+        with self.pool.connection() as connection:
+            pending = connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        with self._lock:
+            return dict(self._stats, pending=pending, scheduled=self._scheduled,
+                        retry_pending=self._retry_timer is not None)
@@ -0,0 +1,181 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from forest import COMPILED_MODEL_FILE, load_compiled, load_mapped, unpack
+from scores import artifact_version
+
+# Versioned model artifacts. Each version is a compiled export (see
+# forest.py) in its own directory, named by its content hash, and
+# manifest.json lists the versions and which one is active:
+#
+#   models/
+#       manifest.json
+#       3f9a1c0d2b7e/organ_matching_model.npz
+#
+#   python registry.py register organ_matching_model.npz --note "retrained"
+#   python registry.py activate 3f9a1c0d2b7e
+#
+# Serving workers pick up a new active version without restarting (see
+# app.reload_model). Without a manifest the app serves COMPILED_MODEL_FILE.
+# Either way the arrays are served memory-mapped (see forest.unpack), so
+# every instance on the host shares them through the page cache.
+
+REGISTRY_DIR = os.environ.get('MODEL_REGISTRY', 'models')
+MANIFEST_FILE = 'manifest.json'
+ARTIFACT_FILE = 'organ_matching_model.npz'
+
+# Features the validation warm-up scores: ages, distances and urgency levels
+# spread over the range the app produces
+PROBE_AGE_GAPS = (0, 1, 2, 5, 10, 20, 40, 60)
+PROBE_DISTANCES_KM = (0, 1, 5, 20, 50, 100, 300, 1000, 3000, 10000)
+PROBE_URGENCY_LEVELS = (1, 2, 3, 4)
+
+
+def manifest_path(root=REGISTRY_DIR):
+    return os.path.join(root, MANIFEST_FILE)
+
+
+def read_manifest(root=REGISTRY_DIR):
+    try:
+        with open(manifest_path(root)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'active': None, 'versions': []}
+
+
+def write_manifest(manifest, root=REGISTRY_DIR):
+    # Written beside the old one and renamed over it, so readers only ever
+    # see a complete manifest
+    os.makedirs(root, exist_ok=True)
+    temporary = manifest_path(root) + f'.{os.getpid()}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, manifest_path(root))
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def register(source, note='', root=REGISTRY_DIR, activate=False):
+    # Copy a compiled artifact into the registry and return its version.
+    # Registering the same artifact again returns the existing version.
+    version = artifact_version((source,))
+    manifest = read_manifest(root)
+    if not any(entry['version'] == version for entry in manifest['versions']):
+        directory = os.path.join(root, version)
+        os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, ARTIFACT_FILE + '.tmp')
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, os.path.join(directory, ARTIFACT_FILE))
+        manifest['versions'].append({
+            'version': version,
+            'sha1': file_sha1(source),
+            'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'note': note,
+        })
+    if activate:
+        manifest['active'] = version
+    write_manifest(manifest, root)
+    return version
+
+
+def activate(version, root=REGISTRY_DIR):
+    manifest = read_manifest(root)
+    if not any(entry['version'] == version for entry in manifest['versions']):
+        raise KeyError(f"Unknown model version {version}")
+    manifest['active'] = version
+    write_manifest(manifest, root)
+
+
+def artifact_path(version=None, root=REGISTRY_DIR):
+    # Path of a registered version (default: the active one), or
+    # COMPILED_MODEL_FILE when the registry has no active version
+    if version is None:
+        version = read_manifest(root)['active']
+        if version is None:
+            return COMPILED_MODEL_FILE
+    manifest = read_manifest(root)
+    entry = next((entry for entry in manifest['versions'] if entry['version'] == version), None)
+    if entry is None:
+        raise KeyError(f"Unknown model version {version}")
+    path = os.path.join(root, version, ARTIFACT_FILE)
+    if file_sha1(path) != entry['sha1']:
+        raise ValueError(f"Model version {version} does not match its manifest checksum")
+    return path
+
+
+def probe_features():
+    from matching import build_features
+    gaps, distances, urgency = np.meshgrid(PROBE_AGE_GAPS, PROBE_DISTANCES_KM, PROBE_URGENCY_LEVELS,
+                                           indexing='ij')
+    return build_features(40 + gaps.ravel(), urgency.ravel(), 40, distances.ravel())
+
+
+def validate(model, scaler):
+    # Score the probe features through the loaded pair; raises if anything
+    # is off. The first predictions also warm the arrays up before the pair
+    # serves requests.
+    from matching import score_features
+    features = probe_features()
+    started = time.perf_counter()
+    scores = score_features(model, scaler, features)
+    seconds = time.perf_counter() - started
+    if scores.shape != (len(features),) or not np.all(np.isfinite(scores)):
+        raise ValueError("Model produced missing or non-finite scores")
+    if getattr(model, 'grid', None) is not None:
+        # The lookup grid must agree with walking the trees
+        if not np.array_equal(scores, model.predict_nodes(scaler.transform(features))):
+            raise ValueError("Model lookup grid disagrees with its trees")
+    return {'probes': len(features), 'seconds': seconds,
+            'min_score': float(scores.min()), 'max_score': float(scores.max())}
+
+
+def load(version=None, root=REGISTRY_DIR):
+    # (model, scaler, model_version) for a version (default: the active one),
+    # memory-mapped and validated. model_version is what gets stored with
+    # every score.
+    path = artifact_path(version, root)
+    model, scaler = load_mapped(unpack(path))
+    validate(model, scaler)
+    return model, scaler, artifact_version((path,))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Manage versioned model artifacts")
+    parser.add_argument('--root', default=REGISTRY_DIR, help="registry directory")
+    commands = parser.add_subparsers(dest='command', required=True)
+    register_parser = commands.add_parser('register', help="add a compiled artifact")
+    register_parser.add_argument('file', nargs='?', default=COMPILED_MODEL_FILE)
+    register_parser.add_argument('--note', default='')
+    register_parser.add_argument('--activate', action='store_true')
+    activate_parser = commands.add_parser('activate', help="make a registered version the active one")
+    activate_parser.add_argument('version')
+    commands.add_parser('list', help="show registered versions")
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        model, scaler = load_compiled(args.file)
+        print(f"Validated: {validate(model, scaler)}")
+        version = register(args.file, args.note, args.root, args.activate)
+        print(f"Registered {version}" + (" (active)" if args.activate else ""))
+    elif args.command == 'activate':
+        load(args.version, args.root)
+        activate(args.version, args.root)
+        print(f"Activated {args.version}; serving workers switch over without restarting")
+    else:
+        manifest = read_manifest(args.root)
+        for entry in manifest['versions']:
+            marker = '*' if entry['version'] == manifest['active'] else ' '
+            print(f"{marker} {entry['version']}  {entry['created_at']}  {entry['note']}")
@@ -0,0 +1,189 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import numpy as np
+from blood import RULES, donor_types, recipient_types
+from forest import COMPILED_MODEL_FILE
+from geo import distance_matrix, distances_km, vectors_from_rows
+from matching import build_features, score_features
+
+# SQLite database file name
+DB_FILE = 'organ_donation.db'
+
+# Artifacts whose contents determine the scores
+MODEL_FILES = (COMPILED_MODEL_FILE,)
+
+DONOR_COLUMNS = "id, age, latitude, longitude, geo_x, geo_y, geo_z"
+RECIPIENT_COLUMNS = "id, age, urgency_level, latitude, longitude, geo_x, geo_y, geo_z"
+
+# Donor/recipient pairs per model call when scoring a batch
+PAIR_CHUNK = 200000
+
+
+def artifact_version(paths=MODEL_FILES):
+    # Short content hash recorded with every stored score. The candidate
+    # rules (blood.RULES) are part of it, so a rule change makes stored
+    # scores stale just like a new model does.
+    digest = hashlib.sha1(RULES.encode())
+    for path in paths:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def score_recipient(cursor, model, scaler, recipient_id):
+    # (donor_id, recipient_id, distance_km, score) for every donor of the
+    # organ this recipient needs whose blood type the recipient can receive
+    cursor.execute(f"SELECT {RECIPIENT_COLUMNS}, needed_organ, blood_type FROM recipients WHERE id = ?",
+                   (recipient_id,))
+    recipient = cursor.fetchone()
+    if recipient is None:
+        return []
+
+    cursor.execute(f"""
+        SELECT {DONOR_COLUMNS} FROM donors
+        WHERE organ = ? AND blood_type IN (SELECT value FROM json_each(?))
+    """, (recipient[8], json.dumps(donor_types(recipient[9]))))
+    donors = cursor.fetchall()
+
+    distances = distances_km(vectors_from_rows([recipient], 3, 4, 5)[0],
+                             vectors_from_rows(donors, 2, 3, 4))
+    features = build_features(recipient[1], recipient[2], [donor[1] for donor in donors], distances)
+    scores = score_features(model, scaler, features)
+    return [(donor[0], recipient_id, float(distance), float(score))
+            for donor, distance, score in zip(donors, distances, scores)]
+
+
+def score_donor(cursor, model, scaler, donor_id):
+    # (donor_id, recipient_id, distance_km, score) for every recipient
+    # needing the organ this donor gives who can receive its blood type
+    cursor.execute(f"SELECT {DONOR_COLUMNS}, organ, blood_type FROM donors WHERE id = ?", (donor_id,))
+    donor = cursor.fetchone()
+    if donor is None:
+        return []
+
+    cursor.execute(f"""
+        SELECT {RECIPIENT_COLUMNS} FROM recipients
+        WHERE needed_organ = ? AND blood_type IN (SELECT value FROM json_each(?))
+    """, (donor[7], json.dumps(recipient_types(donor[8]))))
+    recipients = cursor.fetchall()
+
+    distances = distances_km(vectors_from_rows([donor], 2, 3, 4)[0],
+                             vectors_from_rows(recipients, 3, 4, 5))
+    features = build_features([recipient[1] for recipient in recipients],
+                              [recipient[2] for recipient in recipients], donor[1], distances)
+    scores = score_features(model, scaler, features)
+    return [(donor_id, recipient[0], float(distance), float(score))
+            for recipient, distance, score in zip(recipients, distances, scores)]
+
+
+def score_pairs(model, scaler, donors, recipients):
+    # (donor_id, recipient_id, distance_km, score) for every donor x recipient
+    # pair, from DONOR_COLUMNS and RECIPIENT_COLUMNS rows. Donors are taken a
+    # block at a time so each model call sees about PAIR_CHUNK pairs.
+    if not donors or not recipients:
+        return []
+    donor_vectors = vectors_from_rows(donors, 2, 3, 4)
+    recipient_vectors = vectors_from_rows(recipients, 3, 4, 5)
+    donor_ids = np.array([donor[0] for donor in donors])
+    donor_ages = np.array([donor[1] for donor in donors], dtype=np.float64)
+    recipient_ids = np.array([recipient[0] for recipient in recipients])
+    recipient_ages = np.array([recipient[1] for recipient in recipients], dtype=np.float64)
+    urgency_levels = np.array([recipient[2] for recipient in recipients], dtype=np.float64)
+
+    rows = []
+    step = max(1, PAIR_CHUNK // len(recipients))
+    for start in range(0, len(donors), step):
+        block = slice(start, start + step)
+        count = len(donor_ids[block])
+        distances = distance_matrix(donor_vectors[block], recipient_vectors).ravel()
+        features = build_features(np.tile(recipient_ages, count), np.tile(urgency_levels, count),
+                                  np.repeat(donor_ages[block], len(recipients)), distances)
+        scores = score_features(model, scaler, features)
+        rows.extend(zip(np.repeat(donor_ids[block], len(recipients)).tolist(),
+                        np.tile(recipient_ids, count).tolist(), distances.tolist(), scores.tolist()))
+    return rows
+
+
+def score_donor_rows(cursor, model, scaler, donors):
+    # score_donor for many donors at once: DONOR_COLUMNS rows followed by the
+    # organ and blood type. Recipients are read once per organ and type.
+    groups = {}
+    for donor in donors:
+        groups.setdefault((donor[7], donor[8]), []).append(donor)
+    rows = []
+    for (organ, blood_type), group in groups.items():
+        cursor.execute(f"""
+            SELECT {RECIPIENT_COLUMNS} FROM recipients
+            WHERE needed_organ = ? AND blood_type IN (SELECT value FROM json_each(?))
+        """, (organ, json.dumps(recipient_types(blood_type))))
+        rows += score_pairs(model, scaler, group, cursor.fetchall())
+    return rows
+
+
+def score_recipient_rows(cursor, model, scaler, recipients):
+    # score_recipient for many recipients at once: RECIPIENT_COLUMNS rows
+    # followed by the needed organ and blood type. Donors are read once per
+    # organ and type.
+    groups = {}
+    for recipient in recipients:
+        groups.setdefault((recipient[8], recipient[9]), []).append(recipient)
+    rows = []
+    for (organ, blood_type), group in groups.items():
+        cursor.execute(f"""
+            SELECT {DONOR_COLUMNS} FROM donors
+            WHERE organ = ? AND blood_type IN (SELECT value FROM json_each(?))
+        """, (organ, json.dumps(donor_types(blood_type))))
+        rows += score_pairs(model, scaler, cursor.fetchall(), group)
+    return rows
+
+
+def save_scores(cursor, rows, model_version):
+    cursor.executemany("""
+        INSERT OR REPLACE INTO compatibility_scores
+        (donor_id, recipient_id, distance_km, score, model_version)
+        VALUES (?, ?, ?, ?, ?)
+    """, [row + (model_version,) for row in rows])
+
+
+def mark_scored(cursor, recipient_ids, model_version):
+    # Record that these recipients' candidates were all scored by
+    # model_version, including recipients that have none
+    cursor.executemany("INSERT OR REPLACE INTO scored_recipients (recipient_id, model_version) VALUES (?, ?)",
+                       [(recipient_id, model_version) for recipient_id in recipient_ids])
+
+
+def rebuild(connection, model, scaler, model_version):
+    # Regenerate every stored score, e.g. after retraining the model
+    cursor = connection.cursor()
+    cursor.execute("DELETE FROM compatibility_scores")
+    cursor.execute("DELETE FROM scored_recipients")
+    cursor.execute("SELECT id FROM recipients")
+    total = 0
+    for (recipient_id,) in cursor.fetchall():
+        rows = score_recipient(cursor, model, scaler, recipient_id)
+        save_scores(cursor, rows, model_version)
+        mark_scored(cursor, [recipient_id], model_version)
+        total += len(rows)
+    connection.commit()
+    cursor.close()
+    return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain the compatibility_scores table")
+    parser.add_argument('--db', default=DB_FILE, help="database file")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="recompute every donor/recipient score with the current model")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        import registry
+        connection = sqlite3.connect(args.db)
+        model, scaler, model_version = registry.load()
+        total = rebuild(connection, model, scaler, model_version)
+        connection.close()
+        print(f"Rebuilt {total} compatibility scores.")
+    else:
+        parser.print_help()
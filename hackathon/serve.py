@@ -0,0 +1,53 @@
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from message_queue import DEFAULT_URL, socket_path, start_relay
+
+# Start the production real-time mode on one machine: the UNIX socket
+# message queue plus one gunicorn instance per port (see gunicorn.conf.py).
+# Put nginx.conf in front for a single sticky-session address.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run several LifeLink instances sharing a message queue")
+    parser.add_argument('--instances', type=int, default=4)
+    parser.add_argument('--base-port', type=int, default=8001)
+    parser.add_argument('--async-mode', choices=('gevent', 'eventlet'), default='gevent')
+    parser.add_argument('--message-queue', default=DEFAULT_URL,
+                        help="unix:// (private default socket) or unix:///path runs the local relay here; "
+                             "redis:// etc. use that broker")
+    args = parser.parse_args()
+
+    relay = None
+    if args.message_queue.startswith('unix://'):
+        # Resolved here so the instances use exactly the relay's socket
+        args.message_queue = f"unix://{socket_path(args.message_queue)}"
+        relay = start_relay(args.message_queue)
+    processes = []
+    for port in range(args.base_port, args.base_port + args.instances):
+        env = dict(os.environ, PORT=str(port), SOCKETIO_ASYNC_MODE=args.async_mode,
+                   SOCKETIO_MESSAGE_QUEUE=args.message_queue)
+        processes.append(subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                          env=env))
+    print(f"{args.instances} instances on ports {args.base_port}-{args.base_port + args.instances - 1}, "
+          f"message queue {args.message_queue}")
+
+    try:
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        for process in processes:
+            process.wait()
+        if relay:
+            relay.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import sqlite3
+import time
+import numpy as np
+from geo import unit_vectors
+from migrations import migrate
+
+# Synthetic population for load testing, written into the real schema:
+#
+#   python synthetic.py --db /tmp/bench.db --donors 100000 --recipients 10000
+#
+# Distributions are rough but realistic: ABO/Rh frequencies of the general
+# population, kidneys far more common than other organs, and locations
+# clustered around large Indian cities.
+
+BLOOD_TYPES = ('O+', 'A+', 'B+', 'AB+', 'O-', 'A-', 'B-', 'AB-')
+BLOOD_TYPE_WEIGHTS = (0.374, 0.357, 0.085, 0.034, 0.066, 0.063, 0.015, 0.006)
+
+# Values as submitted by the registration form
+ORGANS = ('kidney', 'liver', 'heart', 'lungs', 'pancreas')
+ORGAN_WEIGHTS = (0.60, 0.20, 0.08, 0.08, 0.04)
+
+URGENCY_LEVELS = (1, 2, 3, 4)
+URGENCY_WEIGHTS = (0.35, 0.30, 0.25, 0.10)
+
+# (latitude, longitude, weight)
+CITIES = (
+    (28.61, 77.21, 0.16),  # Delhi
+    (19.08, 72.88, 0.15),  # Mumbai
+    (12.97, 77.59, 0.11),  # Bengaluru
+    (22.57, 88.36, 0.10),  # Kolkata
+    (13.08, 80.27, 0.09),  # Chennai
+    (17.39, 78.49, 0.09),  # Hyderabad
+    (23.02, 72.57, 0.07),  # Ahmedabad
+    (18.52, 73.86, 0.07),  # Pune
+    (26.91, 75.79, 0.05),  # Jaipur
+    (26.85, 80.95, 0.05),  # Lucknow
+    (9.93, 76.27, 0.03),   # Kochi
+    (30.73, 76.78, 0.03),  # Chandigarh
+)
+CITY_SPREAD_DEGREES = 0.35
+
+REQUEST_STATUSES = ('pending', 'accepted', 'declined')
+REQUEST_STATUS_WEIGHTS = (0.6, 0.15, 0.25)
+
+BATCH_SIZE = 50000
+
+
+def choose(rng, values, weights, size):
+    return np.asarray(values)[rng.choice(len(values), size=size, p=np.asarray(weights) / np.sum(weights))]
+
+
+def locations(rng, size):
+    cities = np.asarray(CITIES)
+    picked = cities[rng.choice(len(cities), size=size, p=cities[:, 2] / cities[:, 2].sum())]
+    latitudes = picked[:, 0] + rng.normal(0, CITY_SPREAD_DEGREES, size)
+    longitudes = picked[:, 1] + rng.normal(0, CITY_SPREAD_DEGREES, size)
+    return np.round(latitudes, 6), np.round(longitudes, 6)
+
+
+def people(rng, kind, start, size, age_mean, age_sd):
+    # Columns shared by donors, recipients and their pre_* tables
+    numbers = np.arange(start, start + size)
+    names = [f"Synthetic {kind.title()} {n}" for n in numbers]
+    emails = [f"{kind}{n}@synthetic.example" for n in numbers]
+    blood_types = choose(rng, BLOOD_TYPES, BLOOD_TYPE_WEIGHTS, size)
+    organs = choose(rng, ORGANS, ORGAN_WEIGHTS, size)
+    ages = np.clip(np.round(rng.normal(age_mean, age_sd, size)), 18 if kind == 'donor' else 1, 80).astype(int)
+    latitudes, longitudes = locations(rng, size)
+    return names, emails, blood_types, organs, ages, latitudes, longitudes
+
+
+def insert_donors(cursor, rng, table, start, count):
+    for offset in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - offset)
+        names, emails, blood_types, organs, ages, latitudes, longitudes = people(
+            rng, 'donor', start + offset, size, 40, 12)
+        rows = zip(names, emails, blood_types, organs, ages.tolist(), longitudes.tolist(), latitudes.tolist())
+        if table == 'donors':
+            vectors = unit_vectors(latitudes, longitudes).tolist()
+            cursor.executemany("""
+                INSERT INTO donors (full_name, email, blood_type, organ, age, longitude, latitude,
+                                    geo_x, geo_y, geo_z)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (row + tuple(vector) for row, vector in zip(rows, vectors)))
+        else:
+            cursor.executemany(f"""
+                INSERT INTO {table} (full_name, email, blood_type, organ, age, longitude, latitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        users(cursor, emails, 'donor')
+
+
+def insert_recipients(cursor, rng, table, start, count):
+    for offset in range(0, count, BATCH_SIZE):
+        size = min(BATCH_SIZE, count - offset)
+        names, emails, blood_types, organs, ages, latitudes, longitudes = people(
+            rng, 'recipient', start + offset, size, 50, 15)
+        urgency = choose(rng, URGENCY_LEVELS, URGENCY_WEIGHTS, size)
+        rows = zip(names, emails, blood_types, organs, urgency.tolist(), ages.tolist(),
+                   longitudes.tolist(), latitudes.tolist())
+        if table == 'recipients':
+            vectors = unit_vectors(latitudes, longitudes).tolist()
+            cursor.executemany("""
+                INSERT INTO recipients (full_name, email, blood_type, needed_organ, urgency_level, age,
+                                        longitude, latitude, geo_x, geo_y, geo_z)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (row + tuple(vector) for row, vector in zip(rows, vectors)))
+        else:
+            cursor.executemany(f"""
+                INSERT INTO {table} (full_name, email, blood_type, needed_organ, urgency_level, age,
+                                     longitude, latitude)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+        users(cursor, emails, 'recipient')
+
+
+def users(cursor, emails, user_type):
+    cursor.executemany("INSERT OR IGNORE INTO users (email, password, user_type) VALUES (?, 'password', ?)",
+                       ((email, user_type) for email in emails))
+
+
+def insert_requests(cursor, rng, per_recipient):
+    # Requests from recipients to random donors of the organ they need, plus
+    # a match row for every accepted one
+    cursor.execute("SELECT id, full_name, needed_organ FROM recipients")
+    recipients = cursor.fetchall()
+    donors = {}
+    for organ in ORGANS:
+        cursor.execute("SELECT id, full_name FROM donors WHERE organ = ?", (organ,))
+        donors[organ] = cursor.fetchall()
+
+    total = 0
+    for offset in range(0, len(recipients), BATCH_SIZE):
+        requests, matches = [], []
+        for recipient_id, recipient_name, organ in recipients[offset:offset + BATCH_SIZE]:
+            candidates = donors.get(organ)
+            if not candidates:
+                continue
+            count = min(rng.poisson(per_recipient), len(candidates))
+            picked = rng.choice(len(candidates), size=count, replace=False)
+            statuses = choose(rng, REQUEST_STATUSES, REQUEST_STATUS_WEIGHTS, count)
+            for index, status in zip(picked, statuses):
+                donor_id, donor_name = candidates[index]
+                requests.append((donor_id, recipient_id, status))
+                if status == 'accepted':
+                    matches.append((donor_id, recipient_id, donor_name, recipient_name, organ))
+        cursor.executemany("INSERT INTO requests (donor_id, recipient_id, status) VALUES (?, ?, ?)", requests)
+        cursor.executemany("""
+            INSERT INTO matches (donor_id, recipient_id, donor_name, recipient_name, organ)
+            VALUES (?, ?, ?, ?, ?)
+        """, matches)
+        total += len(requests)
+    return total
+
+
+def insert_notifications(cursor):
+    # What approve_donor/submit publish: one new-donor event per donor on
+    # its organ's topic, read by every recipient of that organ
+    cursor.execute("""
+        INSERT INTO notification_events (topic, message, type)
+        SELECT 'organ:' || organ, 'New donor available: ' || full_name || ' for organ: ' || organ, 'new_donor'
+        FROM donors ORDER BY id
+    """)
+    return cursor.rowcount
+
+
+def generate(db_file, donors, recipients, pending, requests_per_recipient, seed=0):
+    migrate(db_file)
+    rng = np.random.default_rng(seed)
+    connection = sqlite3.connect(db_file)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=OFF")
+    cursor = connection.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM users")
+    start = cursor.fetchone()[0] + 1  # keeps emails unique when run again
+
+    insert_donors(cursor, rng, 'donors', start, donors)
+    insert_recipients(cursor, rng, 'recipients', start, recipients)
+    pending_donors = int(donors * pending)
+    pending_recipients = int(recipients * pending)
+    insert_donors(cursor, rng, 'pre_donors', start + donors, pending_donors)
+    insert_recipients(cursor, rng, 'pre_recipients', start + recipients, pending_recipients)
+    insert_requests(cursor, rng, requests_per_recipient)
+    insert_notifications(cursor)
+    connection.commit()
+
+    counts = {}
+    for table in ('users', 'donors', 'recipients', 'pre_donors', 'pre_recipients', 'requests', 'matches',
+                  'notification_events'):
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        counts[table] = cursor.fetchone()[0]
+    connection.execute("ANALYZE")
+    connection.close()
+    return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Populate a database with synthetic donors and recipients")
+    parser.add_argument('--db', required=True, help="database file (created or added to)")
+    parser.add_argument('--donors', type=int, default=10000)
+    parser.add_argument('--recipients', type=int, default=1000)
+    parser.add_argument('--pending', type=float, default=0.01,
+                        help="extra pre_donors/pre_recipients awaiting approval, as a fraction")
+    parser.add_argument('--requests-per-recipient', type=float, default=3.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(args.db, args.donors, args.recipients, args.pending, args.requests_per_recipient, args.seed)
+    print(f"Generated in {time.perf_counter() - start:.1f}s:")
+    for table, count in counts.items():
+        print(f"    {table:<20} {count}")
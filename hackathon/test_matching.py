@@ -0,0 +1,111 @@
+import math
+import os
+import sqlite3
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from forest import load_compiled
+from geo import EARTH_RADIUS_KM, unit_vector
+from matching import FEATURES
+from migrations import migrate
+from scores import DONOR_COLUMNS, RECIPIENT_COLUMNS, score_pairs, score_recipient
+
+# Batched scoring (one scaler.transform + model.predict per candidate set)
+# must give exactly the scores match() used to compute one donor at a time.
+#
+#   cd hackathon && python -m pytest -q test_matching.py
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BLOOD_TYPES = ('A+', 'A-', 'AB+', 'AB-', 'B+', 'B-', 'O+', 'O-')
+ORGANS = ('kidney', 'liver')
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    # The per-row distance match() used before geo.py
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return EARTH_RADIUS_KM * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def sklearn_pair():
+    return joblib.load(os.path.join(HERE, 'organ_matching_model.pkl')), joblib.load(os.path.join(HERE, 'scaler.pkl'))
+
+
+def compiled_pair():
+    return load_compiled(os.path.join(HERE, 'organ_matching_model.npz'))
+
+
+@pytest.fixture
+def connection(tmp_path):
+    # Stored donors and recipients at random locations, ages and urgencies
+    path = str(tmp_path / 'organ_donation.db')
+    migrate(path)
+    connection = sqlite3.connect(path)
+    rng = np.random.default_rng(7)
+    for table, count in (('donors', 150), ('recipients', 30)):
+        rows = []
+        for i in range(count):
+            latitude, longitude = float(rng.uniform(-60, 70)), float(rng.uniform(-180, 180))
+            row = (f'{table} {i}', f'{table}{i}@example.com', str(rng.choice(BLOOD_TYPES)),
+                   str(rng.choice(ORGANS)), int(rng.integers(18, 80)))
+            if table == 'recipients':
+                row += (int(rng.integers(1, 5)),)
+            rows.append(row + (longitude, latitude) + unit_vector(latitude, longitude))
+        columns = ('full_name, email, blood_type, organ, age' if table == 'donors'
+                   else 'full_name, email, blood_type, needed_organ, age, urgency_level')
+        connection.executemany(f"""
+            INSERT INTO {table} ({columns}, longitude, latitude, geo_x, geo_y, geo_z)
+            VALUES ({', '.join('?' * (len(rows[0])))})
+        """, rows)
+    connection.commit()
+    yield connection
+    connection.close()
+
+
+def score_one(model, scaler, recipient, donor, distance):
+    # match() before batching: one DataFrame row, one transform, one predict
+    input_data = pd.DataFrame([{
+        'age_similarity': 1 / (1 + abs(donor[1] - recipient[1])),
+        'distance_score': 1 / (1 + distance),
+        'urgency_level': recipient[2],
+    }], columns=FEATURES)
+    if not hasattr(scaler, 'feature_names_in_'):
+        input_data = input_data.to_numpy()
+    return model.predict(scaler.transform(input_data))[0]
+
+
+@pytest.mark.parametrize('load', [sklearn_pair, compiled_pair])
+def test_batched_scores_equal_per_row(connection, load):
+    model, scaler = load()
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {RECIPIENT_COLUMNS} FROM recipients ORDER BY id")
+    recipients = cursor.fetchall()
+    cursor.execute(f"SELECT {DONOR_COLUMNS} FROM donors")
+    donors = {donor[0]: donor for donor in cursor.fetchall()}
+
+    compared = 0
+    for recipient in recipients:
+        for donor_id, _, distance, score in score_recipient(cursor, model, scaler, recipient[0]):
+            donor = donors[donor_id]
+            assert distance == pytest.approx(haversine(recipient[3], recipient[4], donor[2], donor[3]),
+                                             rel=1e-9, abs=1e-6)
+            assert score == score_one(model, scaler, recipient, donor, distance)
+            compared += 1
+    assert compared > 100
+
+
+def test_score_pairs_equals_score_recipient(connection):
+    model, scaler = compiled_pair()
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {RECIPIENT_COLUMNS} FROM recipients ORDER BY id")
+    recipients = cursor.fetchall()
+    cursor.execute(f"SELECT {DONOR_COLUMNS} FROM donors")
+    pairs = {(donor_id, recipient_id): (distance, score)
+             for donor_id, recipient_id, distance, score in score_pairs(model, scaler, cursor.fetchall(), recipients)}
+
+    for recipient in recipients:
+        for donor_id, recipient_id, distance, score in score_recipient(cursor, model, scaler, recipient[0]):
+            assert pairs[(donor_id, recipient_id)] == pytest.approx((distance, score), abs=1e-6)
@@ -0,0 +1,67 @@
+import time
+import pytest
+import outbox
+from background import TaskQueue
+from database import ConnectionPool
+from migrations import migrate
+
+# Outbox rows must be delivered at least once: after a failed send with no
+# later commit to wake the dispatcher, and when left by an earlier worker.
+#
+#   cd hackathon && python -m pytest -q test_outbox.py
+
+
+class FlakySend:
+    # send() that fails the first `failures` calls, then records deliveries
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.delivered = []
+
+    def __call__(self, room, event, payload):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("message queue down")
+        self.delivered.append((room, event, payload))
+
+
+@pytest.fixture
+def pool(tmp_path):
+    path = str(tmp_path / 'organ_donation.db')
+    migrate(path)
+    return ConnectionPool(path, size=2)
+
+
+def enqueue(pool, room, event, payload):
+    with pool.connection() as connection:
+        outbox.enqueue(connection.cursor(), room, event, payload)
+        connection.commit()
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.monotonic() + seconds
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failed_send_is_retried_without_another_commit(pool):
+    send = FlakySend(failures=2)
+    dispatcher = outbox.OutboxDispatcher(pool, send, TaskQueue('outbox-test'), retry_delay=0.05)
+    enqueue(pool, 'donor:1', 'new_request', {'id': 1})
+    dispatcher.wake()
+
+    assert wait_for(lambda: send.delivered)
+    assert send.delivered == [('donor:1', 'new_request', {'id': 1})]
+    stats = dispatcher.stats()
+    assert stats['pending'] == 0
+    assert stats['failed'] == 2 and stats['retries'] == 2
+
+
+def test_start_sends_rows_left_by_an_earlier_worker(pool):
+    enqueue(pool, 'recipient:7', 'request_update', {'id': 3, 'status': 'accepted'})
+    send = FlakySend()
+    dispatcher = outbox.OutboxDispatcher(pool, send, TaskQueue('outbox-test'), retry_delay=0.05)
+    dispatcher.start()
+
+    assert wait_for(lambda: send.delivered)
+    assert send.delivered == [('recipient:7', 'request_update', {'id': 3, 'status': 'accepted'})]